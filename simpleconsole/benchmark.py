@@ -0,0 +1,214 @@
+# simpleconsole.benchmark
+#
+# Copyright (C) 2012 Benjamin Bengfort
+# License: PSF
+# Author: Benjamin Bengfort <benjamin@bengfort.com>
+
+"""
+Benchmarks for the hot paths of L{simpleconsole.progress}. The meters write
+to an in-memory sink, so the results measure the cost of the meters rather
+than of the terminal. Run the module directly to print the results, one
+JSON document per line so they can be collected to track regressions:
+
+    $ python -m simpleconsole.benchmark --updates 1000000
+    {"benchmark": "update", "meter": "ProgressMeter", "unit": "ns", "value": 5134.4}
+    ...
+
+The benchmarks are:
+
+    update
+        Mean cost of a call to update() while counting to the total.
+
+    render
+        Mean cost of _get_meter(), which formats the meter text.
+
+    refresh
+        Mean cost of refresh(), which renders and writes the meter.
+
+    refresh_bytes
+        Mean number of bytes written to stdout per refresh().
+
+    memory
+        Size in bytes of the attributes of the meter after the number of
+        updates, to catch state that grows for the lifetime of a job.
+"""
+
+__docformat__ = "epytext en"
+
+###########################################################################
+## Imports
+###########################################################################
+
+import sys
+import json
+import time
+
+from optparse import OptionParser, make_option
+from progress import ProgressMeter, TimedProgressMeter
+from progress import BackgroundProgressMeter, BackgroundTimedProgressMeter
+
+###########################################################################
+## Module Constants
+###########################################################################
+
+METERS = (ProgressMeter, TimedProgressMeter)
+BACKGROUND_METERS = (BackgroundProgressMeter, BackgroundTimedProgressMeter)
+
+###########################################################################
+## Helpers
+###########################################################################
+
+class NullSink(object):
+    """
+    A stand in for stdout that discards what is written to it, but keeps
+    count of the writes and the bytes written.
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes  = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes  += len(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return True
+
+def sizeof(obj):
+    """
+    Returns the size of an object in bytes including the items of any
+    containers among its attributes, but not the objects they refer to.
+    """
+    size = sys.getsizeof(obj)
+    for value in getattr(obj, '__dict__', {}).values():
+        size += sys.getsizeof(value)
+        if isinstance(value, (list, tuple, dict, set)) or hasattr(value, 'maxlen'):
+            size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+def result(benchmark, klass, value, unit):
+    return {
+        'benchmark': benchmark,
+        'meter':     klass.__name__,
+        'value':     round(value, 1),
+        'unit':      unit,
+    }
+
+def midway_meter(klass):
+    """
+    Returns a meter of the given class that is halfway to its total with
+    a rate and time estimate, so that rendering takes the longest path.
+    """
+    meter = klass(total=1000000, stdout=NullSink(), rate_refresh=3600)
+    for _ in xrange(50):
+        meter.update(10000)
+        meter.last_update -= 1
+    return meter
+
+###########################################################################
+## Benchmarks
+###########################################################################
+
+def bench_update(klass, updates=1000000, **kwargs):
+    """
+    Returns the mean cost of a call to update() in nanoseconds, for a
+    meter of the given class whose total is the number of updates.
+    """
+    meter = klass(total=updates, stdout=NullSink(), **kwargs)
+    update = meter.update
+
+    start = time.time()
+    for _ in xrange(updates):
+        update(1)
+    elapsed = time.time() - start
+
+    if hasattr(meter, 'stop'):
+        meter.stop()
+
+    return (elapsed / updates) * 1e9
+
+def bench_render(klass, renders=100000):
+    """
+    Returns the mean cost of a call to _get_meter() in nanoseconds.
+    """
+    meter = midway_meter(klass)
+    render = meter._get_meter
+
+    start = time.time()
+    for _ in xrange(renders):
+        render()
+    elapsed = time.time() - start
+
+    return (elapsed / renders) * 1e9
+
+def bench_refresh(klass, refreshes=100000):
+    """
+    Returns the mean cost of a call to refresh() in nanoseconds, and the
+    mean number of bytes written to stdout per refresh, when the rate
+    shown by the meter changes between refreshes.
+    """
+    meter = midway_meter(klass)
+    meter.stdout = sink = NullSink()
+    refresh = meter.refresh
+
+    # Change the rate between refreshes as a running job would
+    start = time.time()
+    for idx in xrange(refreshes):
+        meter.rate_current = 10000.0 + (idx % 100)
+        refresh()
+    elapsed = time.time() - start
+
+    return (elapsed / refreshes) * 1e9, float(sink.bytes) / refreshes
+
+def bench_memory(klass, updates=1000000):
+    """
+    Returns the size in bytes of the meter after the number of updates.
+    The meter is refreshed with every update so that all of the state
+    kept for rendering is exercised.
+    """
+    meter = klass(total=updates * 2, stdout=NullSink(), rate_refresh=0)
+    for _ in xrange(updates):
+        meter.update(1)
+    return sizeof(meter)
+
+def run(updates=1000000, renders=100000):
+    """
+    Generator that runs each of the benchmarks and yields the results.
+    """
+    for klass in METERS + BACKGROUND_METERS:
+        yield result('update', klass, bench_update(klass, updates), 'ns')
+
+    for klass in METERS:
+        yield result('render', klass, bench_render(klass, renders), 'ns')
+
+        cost, size = bench_refresh(klass, renders)
+        yield result('refresh', klass, cost, 'ns')
+        yield result('refresh_bytes', klass, size, 'bytes')
+
+        for count in (updates / 100, updates):
+            memory = result('memory', klass, bench_memory(klass, count), 'bytes')
+            memory['updates'] = count
+            yield memory
+
+def main(argv=None):
+    """
+    Runs the benchmarks and prints the results as JSON, one per line.
+    """
+    parser = OptionParser(prog='simpleconsole.benchmark', option_list=(
+        make_option('-u', '--updates', type='int', default=1000000,
+            help='Number of updates to measure update cost and memory with'),
+        make_option('-r', '--renders', type='int', default=100000,
+            help='Number of renders to measure render and refresh cost with'),
+    ))
+    opts, args = parser.parse_args(argv)
+
+    for row in run(opts.updates, opts.renders):
+        sys.stdout.write(json.dumps(row, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 """
+Base class for console programs that run as UNIX daemons.
+
 Todo: refactor the daemon command so that the execute is a jumptable, e.g. 
 
 start -> method
@@ -12,12 +14,198 @@ etc.
 import os
 import sys
 import time
+import json
+import errno
+import select
+import socket
+import resource
+import ctypes
+import signal
 import atexit
+import sqlite3
+import platform
+import threading
 import traceback
+import multiprocessing
 
-from signal import SIGTERM
+from signal import SIGTERM, SIGKILL, SIGHUP, SIGUSR1
 from optparse import make_option
 from simpleconsole import ConsoleProgram, ConsoleError
+from simpleconsole.spool import JobSpool
+from simpleconsole.scheduler import Scheduler
+from simpleconsole.streams import LogWriter
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        # AsyncDaemonProgram is optional
+        asyncio = None
+
+# Set to the pid of a daemon that re-executes itself to recycle its memory
+RECYCLE_ENV = 'SIMPLECONSOLE_RECYCLE'
+
+# Exit status of a prefork worker that asks to be replaced by a fresh one
+RECYCLE_STATUS = 75
+
+# I/O scheduling classes of ioprio_set(2) and its syscall on each machine
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+IOPRIO_SYSCALLS = {
+    'x86_64': 251, 'amd64': 251, 'i386': 289, 'i686': 289,
+    'aarch64': 30, 'arm64': 30, 'armv7l': 314, 'ppc64le': 273,
+}
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+def pid_exists(pid):
+    """
+    Returns True if a process with the given pid exists and has not exited,
+    counting zombies that their parent has yet to reap as exited.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+        if e.errno != errno.EPERM:
+            raise
+        # Otherwise it exists, but is owned by another user
+
+    try:
+        with open('/proc/%i/stat' % pid) as stat:
+            return stat.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (IOError, IndexError):
+        return True
+
+def wait_for_exit(pid, timeout):
+    """
+    Waits up to timeout seconds for the process with the given pid to
+    exit, returning True if it did. The process doesn't have to be a child,
+    so it is watched with a pidfd where available (Linux 5.3 and Python 3.9)
+    or otherwise polled with an increasing interval.
+    """
+    deadline = time.time() + timeout
+
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is not None:
+        try:
+            fd = pidfd_open(pid)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                return True
+            fd = None
+
+        if fd is not None:
+            try:
+                poller = select.poll()
+                poller.register(fd, select.POLLIN)
+                return bool(poller.poll(max(timeout, 0) * 1000))
+            finally:
+                os.close(fd)
+
+    interval = 0.01
+    while pid_exists(pid):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, 0.25)
+    return True
+
+def process_stats(pid):
+    """
+    Returns the resident memory in bytes, the CPU time in seconds, and the
+    number of threads of the process with the given pid, read from /proc.
+    Returns None if the process doesn't exist or /proc is not available.
+    """
+    try:
+        with open('/proc/%i/stat' % pid) as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+    except (IOError, IndexError):
+        return None
+
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    return {
+        'rss':     int(fields[21]) * resource.getpagesize(),
+        'cpu':     (int(fields[11]) + int(fields[12])) / ticks,
+        'threads': int(fields[17]),
+    }
+
+def peak_rss():
+    """
+    Returns the peak resident memory of this process in bytes, for systems
+    without /proc. getrusage() reports it in bytes on Mac OS X and in
+    kilobytes elsewhere.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def parse_cpus(spec):
+    """
+    Parses a list of CPUs such as "0-3,6" into a set of CPU numbers.
+    """
+    cpus = set()
+    try:
+        for part in spec.split(','):
+            if '-' in part:
+                start, end = part.split('-', 1)
+                cpus.update(xrange(int(start), int(end) + 1))
+            else:
+                cpus.add(int(part))
+    except ValueError:
+        raise ConsoleError("Cannot parse the CPU list '%s'" % spec)
+    if not cpus:
+        raise ConsoleError("The CPU list '%s' is empty" % spec)
+    return cpus
+
+def libc():
+    return ctypes.CDLL(None, use_errno=True)
+
+def has_affinity():
+    """
+    True if set_affinity can restrict the process to CPUs on this system.
+    """
+    return hasattr(os, 'sched_setaffinity') or hasattr(libc(), 'sched_setaffinity')
+
+def ioprio_syscall():
+    """
+    Returns the number of the ioprio_set(2) syscall on this machine, or
+    None if it is not Linux or the number is not known.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    return IOPRIO_SYSCALLS.get(platform.machine())
+
+def set_affinity(cpus):
+    """
+    Restricts the process to the given CPUs, with sched_setaffinity(2)
+    directly where Python does not wrap it (before Python 3.3).
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        return
+
+    mask = (ctypes.c_ulong * 16)()      # A cpu_set_t of 1024 CPUs
+    bits = ctypes.sizeof(ctypes.c_ulong) * 8
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+    if libc().sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+def set_ioprio(klass, level=0):
+    """
+    Sets the I/O scheduling class and priority (0 highest, to 7) of the
+    process with the ioprio_set(2) syscall, which Python doesn't wrap.
+    """
+    number = ioprio_syscall()
+    if number is None:
+        raise OSError(errno.ENOSYS, "ioprio_set is not known on %s %s" % (sys.platform, platform.machine()))
+
+    ioprio = (IOPRIO_CLASSES[klass] << 13) | level
+    if libc().syscall(number, 1, 0, ioprio) != 0:   # IOPRIO_WHO_PROCESS, self
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
 
 class DaemonProgram(ConsoleProgram):
     """
@@ -27,14 +215,129 @@ class DaemonProgram(ConsoleProgram):
     interface for DaemonPrograms is slightly different. 
 
     Also note that the handle method will execute run or a function.
+
+    Stopping the daemon sends it SIGTERM, which sets the stop_event rather
+    than killing it, so handle_daemon should check self.stopping (or sleep
+    with self.wait) and return once it has finished its in-flight work.
+    If the daemon hasn't exited after the shutdown timeout it is killed.
+
+    In prefork mode (the prefork attribute, or the --workers option) the
+    daemon is a master process that owns the pidfile and forks a number of
+    worker processes (by default one per CPU) that each run handle_daemon,
+    restarting any that exit with an increasing backoff. Sockets opened in
+    bind(), which runs in the master before forking, are inherited by the
+    workers.
+
+    The reload action sends the daemon SIGHUP. In prefork mode the master
+    then forks a new generation of workers and retires the old one only
+    once the new workers have finished warmup, so the listening sockets
+    are always served. A single process daemon calls handle_reload on a
+    separate thread while handle_daemon keeps running.
+
+    The daemon answers the status action on a Unix domain control socket
+    (by default next to the pidfile) with its pid, uptime, memory, CPU time
+    and thread count as JSON, along with the counters incremented with
+    incr() and the stats registered with register_stat(). In prefork mode
+    the master asks each worker for its counters and stats over a socket
+    it shares with the worker, and reports them for each worker along with
+    its process stats. The counters, and the stats that are numbers, are
+    also added up across the workers.
+
+    Output to the stdout and stderr files is written in batches by a
+    background thread (see L{LogWriter}) unless log_async is False. The
+    files are rotated when they reach log_max_bytes, if it is set, and are
+    reopened when the daemon receives SIGUSR1, e.g. from logrotate.
+
+    The submit action adds a job, the list of its remaining arguments, to
+    a durable spool (see L{JobSpool}, by default next to the pidfile) and
+    returns at once, whether or not the daemon is running. If spool_workers
+    (or --spool-workers) is set, that many threads in the daemon (in each
+    worker in prefork mode) claim jobs from the spool and pass them to
+    handle_job, retrying jobs that raise with an increasing backoff. A
+    submit wakes the consumers of a single process daemon; prefork workers
+    check the spool every spool_poll seconds.
+
+    Periodic work is added to self.scheduler (see L{Scheduler}) with
+    every() or cron() and run with self.scheduler.run(self.stop_event) in
+    handle_daemon, rather than with a sleeping loop per task.
+
+    To cap the memory of a daemon that slowly leaks, set max_rss (or
+    --max-rss) and/or max_units (or --max-units) and call work_done() after
+    each unit of work (spooled jobs are counted already). Once a ceiling is
+    crossed the daemon is asked to stop as for SIGTERM, so handle_daemon
+    finishes its current unit, and then re-executes itself with the same
+    pid, pidfile and arguments. In prefork mode the worker exits instead
+    and the master forks a fresh worker in its place.
+
+    Right after daemonizing, the daemon can move itself into a cgroup v2
+    group and set its CPU affinity, nice level, I/O scheduling class and
+    priority, and resource limits, from the options below or the class
+    attributes of the same names, so that neighbouring daemons on a host
+    can be isolated without wrapper scripts. Prefork workers inherit them.
     """
     
     opts = (
         make_option('--traceback', action='store_true', help='Print traceback on exception'),
+        make_option('--timeout', type='float', default=None, metavar='SECS',
+            help='Seconds to wait for the daemon to stop before killing it'),
+        make_option('--workers', type='int', default=None, metavar='N',
+            help='Run N prefork worker processes (defaults to the number of CPUs)'),
+        make_option('--spool-workers', type='int', default=None, metavar='N',
+            help='Run N threads that handle jobs submitted to the spool'),
+        make_option('--max-rss', type='int', default=None, metavar='MB',
+            help='Recycle the daemon once its resident memory exceeds MB megabytes'),
+        make_option('--max-units', type='int', default=None, metavar='N',
+            help='Recycle the daemon after N units of work'),
+        make_option('--cpus', default=None, metavar='LIST',
+            help='Run the daemon only on these CPUs, e.g. 0-3,6'),
+        make_option('--nice', type='int', default=None, metavar='N',
+            help='Run the daemon at nice level N'),
+        make_option('--ionice', default=None, metavar='CLASS[:LEVEL]',
+            help='I/O scheduling class (realtime, best-effort or idle) and level 0-7'),
+        make_option('--nofile', type='int', default=None, metavar='N',
+            help='Limit on the number of open files'),
+        make_option('--address-space', type='int', default=None, metavar='MB',
+            help='Limit on the virtual memory of the daemon in megabytes'),
+        make_option('--cgroup', default=None, metavar='PATH',
+            help='cgroup v2 group to run the daemon in, relative to %s' % CGROUP_ROOT),
     )
 
     help = "A Daemon process"
-    args = "start|stop|restart"
+    args = "start|stop|restart|reload|status|submit [arg ...]"
+
+    shutdown_timeout = 10
+    reload_timeout = 60
+
+    prefork = False             # Run handle_daemon in forked workers
+    workers = None              # Number of workers, None for the CPU count
+    worker_backoff = 1.0        # Seconds before restarting a crashed worker
+    worker_backoff_max = 60.0   # Longest delay between worker restarts
+
+    control_path = None         # Control socket, None for the pidfile + .sock
+    control_timeout = 5.0       # Seconds to wait for the daemon to answer
+
+    log_async = True            # Write stdout and stderr on a background thread
+    log_flush_interval = 1.0    # Longest delay before output is written
+    log_max_bytes = None        # Rotate the output files at this size
+    log_backups = 5             # Number of rotated output files kept
+
+    spool_path = None           # Job spool, None for the pidfile + .spool
+    spool_workers = 0           # Threads consuming the spool, 0 to disable
+    spool_poll = 1.0            # Seconds between checks of an empty spool
+    spool_lease = 300.0         # Seconds a job may run before it is retried
+    spool_max_attempts = 5      # Attempts before a job is marked failed
+
+    scheduler_workers = 4       # Threads running scheduled tasks
+
+    max_rss = None              # Recycle above this many bytes of memory
+    max_units = None            # Recycle after this many units of work
+    recycle_check = 5.0         # Seconds between checks of the memory
+
+    cpus = None                 # CPU numbers to run on, or e.g. "0-3,6"
+    nice = None                 # Nice level
+    ionice = None               # I/O class and level, e.g. "best-effort:2"
+    rlimits = {}                # e.g. {'nofile': 65536, 'as': 2 ** 32}
+    cgroup = None               # cgroup v2 group, relative to CGROUP_ROOT
 
     def __init__(self, pidfile, **kwargs):
         """
@@ -50,12 +353,95 @@ class DaemonProgram(ConsoleProgram):
         self.stdout = kwargs.pop('stdout', '/dev/null')
         self.stderr = kwargs.pop('stderr', '/dev/null')
 
+        # Set when the daemon is asked to stop or to reload
+        self.stop_event   = threading.Event()
+        self.reload_event = threading.Event()
+
+        # Options passed to handle_reload in a single process daemon
+        self.reload_opts = None
+        self.reload_lock = threading.Lock()
+
+        # Prefork state, the worker id is None in the master process
+        self.worker_id    = None
+        self.worker_pids  = {}
+        self.worker_conns = {}  # pid -> status socket and its file
+        self.query_seq    = 0   # Matches the replies of the workers
+
+        # Control socket and the values it reports
+        self.control_path   = kwargs.pop('control_path', self.control_path) or self.pidfile + '.sock'
+        self.control_socket = None
+        self.started  = None
+        self.counters = {}
+        self.stats    = {}
+        self.stats_lock = threading.Lock()
+
+        # Background writers of the stdout and stderr files
+        self.logs = []
+
+        # Durable queue of submitted jobs and the threads consuming it
+        spool_path = kwargs.pop('spool_path', self.spool_path) or self.pidfile + '.spool'
+        self.spool = JobSpool(os.path.abspath(spool_path), lease=self.spool_lease,
+                              max_attempts=self.spool_max_attempts)
+        self.spool_wakeup = threading.Event()
+        self.consumers = []
+
+        # Periodic tasks run by handle_daemon
+        self.scheduler = Scheduler(workers=self.scheduler_workers)
+
+        # Set when a ceiling is crossed and the daemon should recycle; a
+        # recycled daemon is already daemonized and owns the pidfile.
+        self.recycle_event = threading.Event()
+        self.recycled = os.environ.pop(RECYCLE_ENV, None) == str(os.getpid())
+        self.units = 0
+
+    @property
+    def stopping(self):
+        """
+        True once the daemon has been asked to stop.
+        """
+        return self.stop_event.is_set()
+
+    def wait(self, seconds):
+        """
+        Sleeps for the given number of seconds, waking early and returning
+        True if the daemon is asked to stop in the meantime.
+        """
+        return self.stop_event.wait(seconds)
+
     def daemonize(self):
         """
         Do the UNIX double-fork magic. See Stevens' Advanced Programming
         in the UNIX Environment for details. (ISBN 0201563177)
         """
 
+        # A recycled daemon was daemonized before it re-executed itself
+        if not self.recycled:
+            self.fork_daemon()
+
+        # Test ability to write to pidfile, which a recycled daemon owns
+        if not self.recycled:
+            self.testpid()
+
+        # Redirect standard file descriptors 
+        sys.stdout.flush()
+        sys.stderr.flush()
+        si = file(self.stdin, 'r')
+        os.dup2(si.fileno(), sys.stdin.fileno())
+        self.redirect_output()
+
+        # write pidfile and cleanup
+        atexit.register(self.cleanup)
+        pid = str(os.getpid())
+        with open(self.pidfile, 'w+') as pidfile:
+            pidfile.write("%s\n" % pid)
+
+        self.install_signal_handlers()
+
+    def fork_daemon(self):
+        """
+        Forks twice so the daemon is not a session leader and is reparented
+        away from the shell, and decouples it from the parent environment.
+        """
         # Perform first fork
         try:
             pid = os.fork()
@@ -79,24 +465,95 @@ class DaemonProgram(ConsoleProgram):
         except OSError as e:
             raise ConsoleError("Fork #2 failed: %s" % str(e))
 
-        # Test ability to write to pidfile
-        self.testpid()
+    def redirect_output(self):
+        """
+        Points the stdout and stderr file descriptors at their files and,
+        if log_async is set, replaces sys.stdout and sys.stderr with log
+        writers, sharing one writer when both are the same file.
+        """
+        if not self.log_async:
+            so = file(self.stdout, 'a+')
+            se = file(self.stderr, 'a+', 0)
+            os.dup2(so.fileno(), sys.stdout.fileno())
+            os.dup2(se.fileno(), sys.stderr.fileno())
+            return
 
-        # Redirect standard file descriptors 
+        streams = {}
+        for name, path in (('stdout', self.stdout), ('stderr', self.stderr)):
+            streams.setdefault(path, []).append(name)
+
+        for path, names in streams.items():
+            if path == os.devnull:
+                null = file(path, 'a+')
+                for name in names:
+                    os.dup2(null.fileno(), getattr(sys, name).fileno())
+                continue
+
+            fds = [getattr(sys, name).fileno() for name in names]
+            log = LogWriter(path, fds, flush_interval=self.log_flush_interval,
+                            max_bytes=self.log_max_bytes, backups=self.log_backups)
+            for name in names:
+                setattr(sys, name, log)
+            self.logs.append(log)
+
+    def sync_logs(self):
+        """
+        Writes out any output the log writers are holding.
+        """
         sys.stdout.flush()
         sys.stderr.flush()
-        si = file(self.stdin, 'r')
-        so = file(self.stdout, 'a+')
-        se = file(self.stderr, 'a+', 0)
-        os.dup2(si.fileno(), sys.stdin.fileno())
-        os.dup2(so.fileno(), sys.stdout.fileno())
-        os.dup2(se.fileno(), sys.stderr.fileno())
+        for log in self.logs:
+            log.sync()
 
-        # write pidfile and cleanup
-        atexit.register(self.cleanup)
-        pid = str(os.getpid())
-        with open(self.pidfile, 'w+') as pidfile:
-            pidfile.write("%s\n" % pid)
+    def install_signal_handlers(self):
+        """
+        Handle SIGTERM by asking handle_daemon to stop, and SIGHUP by
+        asking it to reload. Interrupted system calls are restarted rather
+        than failing with EINTR.
+        """
+        signal.signal(SIGTERM, self.handle_sigterm)
+        signal.siginterrupt(SIGTERM, False)
+
+        signal.signal(SIGUSR1, self.handle_sigusr1)
+        signal.siginterrupt(SIGUSR1, False)
+
+        if self.worker_id is None:
+            signal.signal(SIGHUP, self.handle_sighup)
+            signal.siginterrupt(SIGHUP, False)
+        else:
+            # Workers are reloaded by the master
+            signal.signal(SIGHUP, signal.SIG_IGN)
+
+    def handle_sigterm(self, signum, frame):
+        self.recycle_event.clear()
+        self.stop_event.set()
+        self.scheduler.wake()
+
+    def handle_sighup(self, signum, frame):
+        self.reload_event.set()
+        opts = self.reload_opts
+        if opts is not None:
+            thread = threading.Thread(target=self.reload_daemon, args=(opts,), name="reload")
+            thread.daemon = True
+            thread.start()
+
+    def reload_daemon(self, opts):
+        """
+        Calls handle_reload in a single process daemon. Reloads run one at
+        a time and a failed reload leaves the daemon running as it was.
+        """
+        with self.reload_lock:
+            try:
+                self.handle_reload(**opts)
+            except Exception:
+                sys.stderr.write("Reload failed:\n")
+                traceback.print_exc()
+
+    def handle_sigusr1(self, signum, frame):
+        for log in self.logs:
+            log.reopen()
+        for pid in self.worker_pids.keys():
+            self.signal_worker(pid, SIGUSR1)
 
     def testpid(self):
         try:
@@ -112,6 +569,14 @@ class DaemonProgram(ConsoleProgram):
         Cleanup the process atexit.
         """
         os.remove(self.pidfile)
+        for log in self.logs:
+            log.close()
+        if self.control_socket is not None:
+            self.control_socket.close()
+            try:
+                os.remove(self.control_path)
+            except OSError:
+                pass
 
     def getpid(self):
         """
@@ -128,12 +593,585 @@ class DaemonProgram(ConsoleProgram):
         Start the daemon.
         """
 
-        if self.getpid() is not None:
+        if self.getpid() is not None and not self.recycled:
             message = "A pidfile %s already exists. Perhaps the Daemon is already running?"
             raise ConsoleError(message % self.pidfile)
         else:
+            spool_workers = opts.get('spool_workers')
+            if spool_workers is not None:
+                self.spool_workers = spool_workers
+            if opts.get('max_rss') is not None:
+                self.max_rss = opts['max_rss'] * 1024 * 1024
+            if opts.get('max_units') is not None:
+                self.max_units = opts['max_units']
+
+            workers = opts.get('workers')
+            if workers is None:
+                workers = self.workers
+            if workers is not None and workers < 1:
+                raise ConsoleError("The number of workers must be at least one")
+
+            # Needed to re-execute the daemon once it has been daemonized
+            self.cwd  = os.getcwd()
+            self.argv = [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:]
+
+            # Report invalid tuning options here rather than in the daemon
+            self.tuning(**opts)
+
             self.daemonize()
-            self.handle_daemon(**opts)
+            self.tune_process(**opts)
+            self.started = time.time()
+            self.open_control()
+            self.bind(**opts)
+
+            if self.prefork or opts.get('workers') is not None:
+                self.run_master(workers or multiprocessing.cpu_count(), opts)
+            else:
+                self.warmup(**opts)
+                self.run_daemon(**opts)
+                if self.recycle_event.is_set():
+                    self.reexec()
+
+    def tuning(self, **opts):
+        """
+        Returns the cgroup, CPUs, nice level, I/O priority class and level,
+        and resource limits given by opts or the class attributes, raising
+        ConsoleError if one of them is invalid or is not supported on this
+        system. Called before daemonizing, so that mistakes are reported to
+        the console.
+        """
+        cgroup = opts.get('cgroup') or self.cgroup
+        cpus   = opts.get('cpus') or self.cpus
+        nice   = opts.get('nice') if opts.get('nice') is not None else self.nice
+        ionice = opts.get('ionice') or self.ionice
+
+        if cgroup and not os.path.exists(os.path.join(CGROUP_ROOT, 'cgroup.controllers')):
+            raise ConsoleError("%s is not a cgroup v2 hierarchy" % CGROUP_ROOT)
+
+        if cpus:
+            if isinstance(cpus, basestring):
+                cpus = parse_cpus(cpus)
+            if min(cpus) < 0 or max(cpus) >= 1024:
+                raise ConsoleError("CPUs must be numbered from 0 to 1023")
+            if not has_affinity():
+                raise ConsoleError("Setting the CPU affinity is not supported on %s" % sys.platform)
+
+        if ionice:
+            klass, _, level = ionice.partition(':')
+            if klass not in IOPRIO_CLASSES:
+                raise ConsoleError("Unknown I/O scheduling class '%s'" % klass)
+            level = level or '0'
+            if not level.isdigit() or int(level) > 7:
+                raise ConsoleError("The I/O priority level must be from 0 to 7")
+            ionice = (klass, int(level))
+            if ioprio_syscall() is None:
+                raise ConsoleError("Setting the I/O priority is not supported on %s %s"
+                                   % (sys.platform, platform.machine()))
+
+        rlimits = dict(self.rlimits)
+        if opts.get('nofile') is not None:
+            rlimits['nofile'] = opts['nofile']
+        if opts.get('address_space') is not None:
+            rlimits['as'] = opts['address_space'] * 1024 * 1024
+
+        for name in rlimits:
+            if not hasattr(resource, 'RLIMIT_' + name.upper()):
+                raise ConsoleError("Unknown resource limit '%s'" % name)
+
+        return cgroup, cpus, nice, ionice, rlimits
+
+    def tune_process(self, **opts):
+        """
+        Applies the cgroup, CPU affinity, nice level, I/O priority and
+        resource limits to the daemon, raising ConsoleError if one of them
+        cannot be applied rather than running without it.
+        """
+        cgroup, cpus, nice, ionice, rlimits = self.tuning(**opts)
+
+        try:
+            # The cgroup first, since it may restrict the CPUs available
+            if cgroup:
+                path = os.path.join(CGROUP_ROOT, cgroup.lstrip('/'))
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+                with open(os.path.join(path, 'cgroup.procs'), 'w') as procs:
+                    procs.write("%i\n" % os.getpid())
+
+            if cpus:
+                set_affinity(cpus)
+
+            if nice is not None:
+                os.nice(nice - os.nice(0))
+
+            if ionice:
+                set_ioprio(*ionice)
+
+            for name, limit in rlimits.items():
+                resource_id = getattr(resource, 'RLIMIT_' + name.upper())
+                hard = resource.getrlimit(resource_id)[1]
+                if hard != resource.RLIM_INFINITY:
+                    hard = max(hard, limit)
+                resource.setrlimit(resource_id, (limit, hard))
+
+        except (EnvironmentError, ValueError) as e:
+            raise ConsoleError("Cannot tune the Daemon process: %s" % e)
+
+    def bind(self, **opts):
+        """
+        Called in the daemon before handle_daemon runs, or before the
+        workers are forked in prefork mode, so that listening sockets
+        opened here are shared by all of the workers.
+        """
+        pass
+
+    def open_control(self):
+        """
+        Listens on the control socket and answers requests to it on a
+        background thread for the lifetime of the daemon.
+        """
+        if os.path.exists(self.control_path):
+            os.remove(self.control_path)
+
+        self.control_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.control_socket.bind(self.control_path)
+        os.chmod(self.control_path, 0600)
+        self.control_socket.listen(5)
+
+        thread = threading.Thread(target=self.serve_control)
+        thread.daemon = True
+        thread.start()
+
+    def serve_control(self):
+        """
+        Answers each connection to the control socket with the JSON reply to
+        the command on the first line the client sends.
+        """
+        while True:
+            try:
+                conn, _ = self.control_socket.accept()
+            except socket.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                return
+
+            try:
+                conn.settimeout(self.control_timeout)
+                command = conn.makefile('rb').readline().strip()
+                if command == 'status':
+                    reply = self.status_info()
+                elif command == 'wake':
+                    self.spool_wakeup.set()
+                    reply = {}
+                else:
+                    reply = {'error': "unknown command '%s'" % command}
+                conn.sendall(json.dumps(reply) + "\n")
+            except Exception as e:
+                traceback.print_exc()
+                try:
+                    conn.sendall(json.dumps({'error': "%s: %s" % (e.__class__.__name__, e)}) + "\n")
+                except Exception:
+                    pass
+            finally:
+                conn.close()
+
+    def incr(self, name, amount=1):
+        """
+        Adds amount to the named counter reported by the status action.
+        """
+        with self.stats_lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def register_stat(self, name, func):
+        """
+        Reports the value returned by func, e.g. the depth of a queue, as
+        the named stat in the status action. The function is called on the
+        control thread, so it should be cheap and thread safe. If it raises,
+        the stat is reported as a dict with the error instead.
+        """
+        self.stats[name] = func
+
+    def status_info(self):
+        """
+        Returns a dict describing the running daemon for the status action.
+        """
+        now = time.time()
+        info = {
+            'pid':    os.getpid(),
+            'uptime': now - self.started if self.started else 0.0,
+        }
+
+        info.update(process_stats(os.getpid()) or {
+            'rss':     peak_rss(),
+            'cpu':     sum(os.times()[:2]),
+            'threads': threading.active_count(),
+        })
+
+        info.update(self.local_status())
+
+        if self.spool_workers:
+            info['spool'] = self.spool.counts()
+
+        if self.worker_pids:
+            info['workers'] = []
+            totals = {}
+            for pid, slot in sorted(self.worker_pids.items(), key=lambda item: item[1]):
+                worker = {'slot': slot, 'pid': pid, 'retiring': pid in self.retiring}
+                worker.update(process_stats(pid) or {})
+                worker.update(self.query_worker(pid))
+                info['workers'].append(worker)
+
+                for name, value in worker.get('counters', {}).items():
+                    info['counters'][name] = info['counters'].get(name, 0) + value
+                for name, value in worker.get('stats', {}).items():
+                    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                        totals[name] = totals.get(name, 0) + value
+
+            for name, value in totals.items():
+                info['stats'].setdefault(name, value)
+
+        return info
+
+    def local_status(self):
+        """
+        Returns the counters, stats and scheduler statistics of this
+        process, which is what a worker reports to the master.
+        """
+        with self.stats_lock:
+            info = {'counters': dict(self.counters), 'stats': {}}
+
+        for name, func in self.stats.items():
+            try:
+                info['stats'][name] = func()
+            except Exception as e:
+                info['stats'][name] = {'error': "%s: %s" % (e.__class__.__name__, e)}
+
+        if self.scheduler.heap:
+            info['scheduler'] = self.scheduler.stats()
+
+        return info
+
+    def query_worker(self, pid):
+        """
+        Asks a worker for its local status over its status socket. Returns
+        a dict with the error instead if the worker doesn't answer within
+        the control timeout. Replies to earlier queries that timed out are
+        skipped by their sequence number.
+        """
+        if pid not in self.worker_conns:
+            return {}
+        conn, rfile = self.worker_conns[pid]
+
+        self.query_seq += 1
+        seq = self.query_seq
+        try:
+            conn.sendall("status %i\n" % seq)
+            while True:
+                line = rfile.readline()
+                if not line:
+                    return {'error': "The worker closed its status socket"}
+                try:
+                    reply = json.loads(line)
+                except ValueError:
+                    continue
+                if reply.pop('seq', None) == seq:
+                    return reply
+        except socket.error as e:
+            return {'error': "%s: %s" % (e.__class__.__name__, e)}
+
+    def serve_master(self, conn):
+        """
+        Answers the status queries of the master on conn, in a worker, until
+        the master closes it.
+        """
+        rfile = conn.makefile('rb')
+        try:
+            for line in iter(rfile.readline, ''):
+                command, _, seq = line.strip().partition(' ')
+                try:
+                    if command != 'status':
+                        raise ValueError("unknown command '%s'" % command)
+                    reply = self.local_status()
+                    reply['seq'] = int(seq)
+                    data = json.dumps(reply)
+                except Exception as e:
+                    data = json.dumps({'seq': int(seq or 0), 'error': "%s: %s" % (e.__class__.__name__, e)})
+                conn.sendall(data + "\n")
+        except socket.error:
+            pass
+        finally:
+            rfile.close()
+            conn.close()
+
+    def close_worker_conn(self, pid):
+        """
+        Closes the status socket of a worker that has exited.
+        """
+        conn, rfile = self.worker_conns.pop(pid, (None, None))
+        if conn is not None:
+            rfile.close()
+            conn.close()
+
+    def run_master(self, workers, opts):
+        """
+        Forks the given number of workers, passing each the options dict,
+        and supervises them until the daemon is asked to stop, restarting
+        any worker that fails with an exponential backoff that resets once
+        a worker has run for longer than the maximum backoff. A worker that
+        exits with status 0, because handle_daemon returned, is finished and
+        is not restarted; the master stops once all of them have finished.
+        Reloads the workers when the daemon receives SIGHUP. Then stops the
+        workers.
+        """
+        self.worker_failures = [0] * workers
+        self.worker_started  = [0.0] * workers
+        self.worker_restarts = {}       # slot -> time to restart the worker
+        self.retiring        = set()    # pids of workers being replaced
+
+        for slot in xrange(workers):
+            self.worker_started[slot] = time.time()
+            self.spawn_worker(slot, opts)
+
+        while not self.stopping:
+            for pid, status in self.reap_workers():
+                slot = self.worker_pids.pop(pid)
+                self.close_worker_conn(pid)
+                if pid in self.retiring:
+                    self.retiring.discard(pid)
+                    continue
+
+                if status == RECYCLE_STATUS:
+                    self.worker_failures[slot] = 0
+                    self.worker_restarts[slot] = time.time()
+                    continue
+
+                if status == 0:
+                    sys.stderr.write("Worker %i (pid %i) finished.\n" % (slot, pid))
+                    if not self.worker_pids and not self.worker_restarts:
+                        self.stop_event.set()
+                    continue
+
+                if time.time() - self.worker_started[slot] > self.worker_backoff_max:
+                    self.worker_failures[slot] = 0
+                delay = min(self.worker_backoff * (2 ** self.worker_failures[slot]),
+                            self.worker_backoff_max)
+                self.worker_failures[slot] += 1
+                self.worker_restarts[slot] = time.time() + delay
+                sys.stderr.write("Worker %i (pid %i) exited with status %i, restarting in %.1f sec.\n"
+                                 % (slot, pid, status, delay))
+
+            now = time.time()
+            for slot, due in self.worker_restarts.items():
+                if due <= now:
+                    del self.worker_restarts[slot]
+                    self.worker_started[slot] = now
+                    self.spawn_worker(slot, opts)
+
+            if self.reload_event.is_set():
+                self.reload_event.clear()
+                self.reload_workers(workers, opts)
+
+            self.wait(0.1)
+
+        self.stop_workers()
+
+    def reload_workers(self, workers, opts):
+        """
+        Replaces the workers without downtime: calls handle_reload, forks a
+        new generation of workers that inherit the listening sockets, and
+        waits for each of them to report that it is ready. Only then is the
+        old generation sent SIGTERM to finish its work and exit. If a new
+        worker fails to become ready within the reload timeout, the new
+        generation is stopped instead and the old one keeps running.
+        """
+        try:
+            self.handle_reload(**opts)
+        except Exception:
+            sys.stderr.write("Reload failed, keeping the current workers:\n")
+            traceback.print_exc()
+            return
+
+        old = [pid for pid in self.worker_pids if pid not in self.retiring]
+        new = {}
+        for slot in xrange(workers):
+            pid, fd = self.spawn_worker(slot, opts, notify=True)
+            new[fd] = pid
+
+        ready    = set()
+        deadline = time.time() + self.reload_timeout
+        while len(ready) < len(new) and not self.stopping:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                readable = select.select([fd for fd in new if fd not in ready], [], [], remaining)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in readable:
+                if os.read(fd, 1):
+                    ready.add(fd)
+                else:
+                    # The worker exited before it was ready
+                    deadline = 0
+
+        for fd in new:
+            os.close(fd)
+
+        if len(ready) < len(new):
+            sys.stderr.write("Reload failed, new workers were not ready; keeping the current workers.\n")
+            retire = new.values()
+        else:
+            self.worker_restarts.clear()
+            self.worker_failures = [0] * workers
+            self.worker_started  = [time.time()] * workers
+            retire = old
+
+        for pid in retire:
+            self.retiring.add(pid)
+            self.signal_worker(pid, SIGTERM)
+
+    def spawn_worker(self, slot, opts, notify=False):
+        """
+        Forks a worker process that runs warmup and then handle_daemon with
+        its worker_id set to slot, and exits when handle_daemon returns.
+        Returns the pid of the worker; if notify is set, also returns a
+        file descriptor that the worker writes to once it has warmed up.
+        """
+        self.sync_logs()
+
+        if notify:
+            rfd, wfd = os.pipe()
+
+        # The master queries the worker's counters and stats over this,
+        # wrapped so that makefile() honours the timeout
+        status, worker_status = [socket.socket(_sock=end) for end in socket.socketpair()]
+
+        pid = os.fork()
+        if pid > 0:
+            worker_status.close()
+            status.settimeout(self.control_timeout)
+            self.worker_pids[pid]  = slot
+            self.worker_conns[pid] = (status, status.makefile('rb'))
+            if notify:
+                os.close(wfd)
+                return pid, rfd
+            return pid
+
+        # In the worker; never return to the master's code or run its atexit
+        code = 0
+        try:
+            self.worker_id   = slot
+            self.worker_pids = {}
+            for log in self.logs:
+                log.after_fork()
+            if self.control_socket is not None:
+                self.control_socket.close()
+                self.control_socket = None
+
+            # Only keep this worker's end of its own status socket
+            for other in self.worker_conns.keys():
+                self.close_worker_conn(other)
+            status.close()
+            thread = threading.Thread(target=self.serve_master, args=(worker_status,), name="status")
+            thread.daemon = True
+            thread.start()
+            self.install_signal_handlers()
+            self.warmup(**opts)
+            if notify:
+                os.close(rfd)
+                os.write(wfd, 'R')
+                os.close(wfd)
+            self.run_daemon(**opts)
+            if self.recycle_event.is_set():
+                code = RECYCLE_STATUS
+        except SystemExit as e:
+            # As the interpreter does: None is success, other values are
+            # printed and are a failure
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                sys.stderr.write("%s\n" % e.code)
+                code = 1
+        except:
+            traceback.print_exc()
+            code = 1
+        finally:
+            self.sync_logs()
+            os._exit(code)
+
+    def warmup(self, **opts):
+        """
+        Called in each worker before handle_daemon. On reload, the old
+        workers are only retired once the new workers have returned from
+        warmup, so expensive initialization belongs here.
+        """
+        pass
+
+    def handle_reload(self, **opts):
+        """
+        Called in the daemon when it receives SIGHUP, e.g. to reread
+        configuration files. In prefork mode it runs in the master before
+        a new generation of workers is forked, and raising an exception
+        cancels the reload. A single process daemon calls it on a separate
+        thread while handle_daemon runs.
+        """
+        pass
+
+    def reap_workers(self):
+        """
+        Returns the pids and exit statuses of the workers that have exited,
+        without blocking.
+        """
+        reaped = []
+        while self.worker_pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+            if pid == 0:
+                break
+            if pid in self.worker_pids:
+                code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+                reaped.append((pid, code))
+        return reaped
+
+    def stop_workers(self):
+        """
+        Sends SIGTERM to the workers and waits for them to exit for up to
+        the shutdown timeout, then kills any that are left.
+        """
+        for pid in self.worker_pids:
+            self.signal_worker(pid, SIGTERM)
+
+        deadline = time.time() + self.shutdown_timeout
+        while self.worker_pids and time.time() < deadline:
+            for pid, status in self.reap_workers():
+                del self.worker_pids[pid]
+                self.close_worker_conn(pid)
+            time.sleep(0.05)
+
+        for pid in self.worker_pids:
+            self.signal_worker(pid, SIGKILL)
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            self.close_worker_conn(pid)
+        self.worker_pids.clear()
+
+    def signal_worker(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
 
     def stop(self, **opts):
         """
@@ -147,18 +1185,40 @@ class DaemonProgram(ConsoleProgram):
             message = "The pidfile %s does not exist. Perhaps the Daemon is not running?"
             raise ConsoleError(message % self.pidfile)
         
-        # Attempt to kill the Daemon process
+        timeout = opts.get('timeout')
+        if timeout is None:
+            timeout = self.shutdown_timeout
+
+        # Ask the Daemon process to stop, then wait for it to exit
         try:
-            while True:
-                os.kill(pid, SIGTERM)
-                time.sleep(0.1)
+            os.kill(pid, SIGTERM)
+            if not wait_for_exit(pid, timeout):
+                self.kill(pid)
+                if not wait_for_exit(pid, timeout):
+                    raise ConsoleError("The Daemon process %i could not be killed" % pid)
         except OSError as error:
-            if str(error).find("No such process") > 0:
-                if os.path.exists(self.pidfile):
-                    os.remove(self.pidfile)
-            else:
+            if error.errno != errno.ESRCH:
                 raise ConsoleError(str(error))
 
+        # The Daemon removes its pidfile when it exits, unless it was killed
+        if os.path.exists(self.pidfile):
+            os.remove(self.pidfile)
+
+    def kill(self, pid):
+        """
+        Kills the Daemon process with SIGKILL, along with any workers it
+        forked, which share its process group.
+        """
+        try:
+            pgid = os.getpgid(pid)
+        except OSError:
+            pgid = None
+
+        if pgid is not None and pgid != os.getpgrp():
+            os.killpg(pgid, SIGKILL)
+        else:
+            os.kill(pid, SIGKILL)
+
     def restart(self, **opts):
         """
         Restart the daemon
@@ -166,6 +1226,77 @@ class DaemonProgram(ConsoleProgram):
         self.stop(**opts)
         self.start(**opts)
 
+    def reload(self, **opts):
+        """
+        Asks the running daemon to reload by sending it SIGHUP.
+        """
+        pid = self.getpid()
+
+        if pid is None:
+            message = "The pidfile %s does not exist. Perhaps the Daemon is not running?"
+            raise ConsoleError(message % self.pidfile)
+
+        try:
+            os.kill(pid, SIGHUP)
+        except OSError as error:
+            raise ConsoleError(str(error))
+
+    def submit(self, *args, **opts):
+        """
+        Adds a job with the given arguments to the spool and wakes the
+        daemon's consumers if it is running.
+        """
+        if not args:
+            raise ConsoleError("Provide the arguments of the job to submit.")
+
+        try:
+            job_id = self.spool.submit(list(args))
+        except sqlite3.Error as error:
+            raise ConsoleError("Cannot submit to the spool %s: %s" % (self.spool.path, error))
+
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(self.control_timeout)
+        try:
+            conn.connect(self.control_path)
+            conn.sendall("wake\n")
+            conn.recv(64)
+        except socket.error:
+            # The daemon isn't running, it will find the job when it starts
+            pass
+        finally:
+            conn.close()
+
+        return "Submitted job %i" % job_id
+
+    def status(self, **opts):
+        """
+        Queries the running daemon over its control socket and returns its
+        status as JSON.
+        """
+        if self.getpid() is None:
+            message = "The pidfile %s does not exist. Perhaps the Daemon is not running?"
+            raise ConsoleError(message % self.pidfile)
+
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(self.control_timeout)
+        try:
+            conn.connect(self.control_path)
+            conn.sendall("status\n")
+            reply = conn.makefile('rb').read()
+        except socket.error as error:
+            raise ConsoleError("Cannot query the Daemon at %s: %s" % (self.control_path, error))
+        finally:
+            conn.close()
+
+        try:
+            info = json.loads(reply)
+        except ValueError:
+            raise ConsoleError("The Daemon sent an invalid reply: %r" % reply)
+        if 'error' in info:
+            raise ConsoleError(info['error'])
+
+        return json.dumps(info, indent=2, sort_keys=True)
+
     def execute(self, *args, **opts):
         """
         Handles the execution of the program with correct passing of
@@ -182,9 +1313,9 @@ class DaemonProgram(ConsoleProgram):
             output = self.handle(*args, **opts)
 
             if output:
-                self.stdout.write(output)
-                self.stdout.write("\n")
-                self.stdout.flush()
+                sys.stdout.write(output)
+                sys.stdout.write("\n")
+                sys.stdout.flush()
         except ConsoleError as e:
             if show_traceback:
                 traceback.print_exc()
@@ -194,33 +1325,361 @@ class DaemonProgram(ConsoleProgram):
 
     def handle(self, *args, **opts):
         """
-        Checks the last argument for a daemon command - start, stop, or 
-        restart and then passes the control to the correct method for that
-        argument. In the case of start and restart, the arguments are
-        passed through because start calls handle_daemon which is the same
-        as the run command on a thread. 
+        Checks the first argument for a daemon command - start, stop,
+        restart, reload, status, or submit and then passes the control to
+        the correct method for that argument. In the case of start and
+        restart, the arguments are passed through because start calls
+        handle_daemon which is the same as the run command on a thread.
+        The remaining arguments of submit are the job to submit.
         """
+        # A recycled daemon starts again whatever its original action
+        if self.recycled:
+            return self.start(**opts)
+
         jumptable = {
             'start':   self.start,
             'stop':    self.stop,
             'restart': self.restart,
+            'reload':  self.reload,
+            'status':  self.status,
+            'submit':  self.submit,
         }
 
-        if len(args) != 1:
-            raise ConsoleError("Expected only Daemon argument - %s" % args)
+        if not args or (len(args) != 1 and args[0] != 'submit'):
+            raise ConsoleError("Expected only Daemon argument - %s" % (args,))
         else:
             if args[0] in jumptable:
-                return jumptable[args[0]](**opts)
+                return jumptable[args[0]](*args[1:], **opts)
             else:
                 raise ConsoleError("Unknown Daemon arg '%s' as command argument" % args[0])
 
         return None
 
+    def run_daemon(self, **opts):
+        """
+        Runs handle_daemon in the daemon, or in each worker in prefork mode,
+        along with the spool consumers.
+        """
+        if self.worker_id is None:
+            self.reload_opts = opts
+
+        self.start_consumers()
+        self.start_watchdog()
+        try:
+            self.handle_daemon(**opts)
+        finally:
+            self.reload_opts = None
+            self.stop_consumers()
+
     def handle_daemon(self, **opts):
         """
-        This is the method that should be overrode instead of handle.
+        This is the method that should be overrode instead of handle. It
+        should return soon after self.stopping becomes True. Daemons that
+        only handle spooled jobs need not override it.
+        """
+        if not self.spool_workers:
+            raise NotImplementedError("Must override this method when DaemonProgram is subclassed.")
+
+        while not self.wait(1.0):
+            pass
+
+    def start_consumers(self):
+        """
+        Starts spool_workers threads that consume jobs from the spool.
+        """
+        for idx in xrange(self.spool_workers):
+            thread = threading.Thread(target=self.consume_jobs, name="spool-%i" % idx)
+            thread.daemon = True
+            thread.start()
+            self.consumers.append(thread)
+
+    def stop_consumers(self):
+        """
+        Asks the spool consumers to stop and waits for them to finish their
+        current jobs.
+        """
+        self.stop_event.set()
+        self.spool_wakeup.set()
+        for thread in self.consumers:
+            thread.join(self.shutdown_timeout)
+        self.consumers = []
+
+    def consume_jobs(self):
+        """
+        Claims jobs from the spool and handles them until the daemon stops,
+        acking the jobs that succeed and retrying those that raise.
+        """
+        while not self.stopping:
+            try:
+                job = self.spool.claim()
+            except sqlite3.Error:
+                traceback.print_exc()
+                self.wait(self.spool_poll)
+                continue
+
+            if job is None:
+                self.spool_wakeup.wait(self.spool_poll)
+                self.spool_wakeup.clear()
+                continue
+
+            error = None
+            try:
+                self.handle_job(job.payload)
+            except Exception:
+                error = traceback.format_exc()
+                sys.stderr.write("Job %i failed on attempt %i:\n%s" % (job.id, job.attempts, error))
+
+            # If the spool cannot be updated, the job is claimed again
+            # once its lease expires
+            try:
+                if error is None:
+                    self.spool.ack(job)
+                else:
+                    self.spool.retry(job, error)
+            except sqlite3.Error:
+                traceback.print_exc()
+
+            self.incr('jobs_failed' if error else 'jobs_done')
+            self.work_done()
+
+    def start_watchdog(self):
+        """
+        Checks the resident memory of the daemon every recycle_check seconds
+        on a background thread, if max_rss is set. Without /proc the peak
+        resident memory is checked instead. The peak can be kept across the
+        exec of a recycle, so it only counts once it grows past its value
+        when the watchdog started.
+        """
+        if not self.max_rss:
+            return
+
+        def watch():
+            baseline = peak_rss()
+            while not self.stopping:
+                stats = process_stats(os.getpid())
+                if stats is not None:
+                    rss = stats['rss']
+                else:
+                    rss = peak_rss()
+                    if rss <= baseline:
+                        rss = 0
+
+                if rss > self.max_rss:
+                    self.request_recycle("using %i MB of memory" % (rss / 1048576))
+                    return
+                time.sleep(self.recycle_check)
+
+        thread = threading.Thread(target=watch, name="watchdog")
+        thread.daemon = True
+        thread.start()
+
+    def work_done(self, units=1):
+        """
+        Counts units of work, recycling the daemon after max_units of them.
+        """
+        with self.stats_lock:
+            self.units += units
+            units = self.units
+        if self.max_units and units >= self.max_units:
+            self.request_recycle("%i units of work" % units)
+
+    def request_recycle(self, reason):
+        """
+        Asks the daemon to stop, finishing its current unit of work, and
+        then to re-execute itself. Safe to call from any thread.
+        """
+        if self.recycle_event.is_set() or self.stopping:
+            return
+
+        sys.stderr.write("Recycling the daemon (pid %i) after %s.\n" % (os.getpid(), reason))
+        self.recycle_event.set()
+        self.stop_event.set()
+        self.spool_wakeup.set()
+        self.scheduler.wake()
+
+    def reexec(self):
+        """
+        Replaces the daemon process with a fresh copy of itself, which keeps
+        its pid and so its pidfile, and runs the same command line.
+        """
+        self.sync_logs()
+        if self.control_socket is not None:
+            self.control_socket.close()
+            os.remove(self.control_path)
+
+        # Close the inherited sockets and files, which the new process
+        # would otherwise hold open without knowing about them.
+        maxfd = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+        if maxfd == resource.RLIM_INFINITY or maxfd > 65536:
+            maxfd = 65536
+        os.closerange(3, maxfd)
+
+        os.environ[RECYCLE_ENV] = str(os.getpid())
+        os.chdir(self.cwd)
+        os.execv(self.argv[0], self.argv)
+
+    def handle_job(self, payload):
+        """
+        Override to handle a job claimed from the spool. The payload of a
+        job added with the submit action is the list of its arguments.
         """
-        raise NotImplementedError("Must override this method when DaemonProgram is subclassed.")
+        raise NotImplementedError("Must override this method to consume the job spool.")
+
+class AsyncDaemonProgram(DaemonProgram):
+    """
+    A daemon whose handle_daemon is a coroutine, run on an asyncio event
+    loop that is created after daemonizing (or in each worker in prefork
+    mode), so that one process can multiplex many connections:
+
+        class EchoDaemon(AsyncDaemonProgram):
+
+            @asyncio.coroutine
+            def handle_daemon(self, **opts):
+                server = yield From(asyncio.start_unix_server(self.echo, '/tmp/echo.sock'))
+                self.supervise('flusher', self.flush_stats)
+                yield From(self.wait_stop())
+                server.close()
+
+    SIGTERM sets the shutdown event, which handle_daemon should wait on
+    with wait_stop() and then return, and cancels the supervised tasks.
+    SIGHUP calls handle_reload on the loop, which may return a coroutine.
+
+    Background tasks started with supervise() that raise are logged to
+    stderr and restarted with an increasing backoff. The event loop is
+    asyncio, or trollius on Python 2, where coroutines are written as above
+    with From imported from trollius.
+    """
+
+    task_backoff = 1.0          # Seconds before restarting a crashed task
+    task_backoff_max = 60.0     # Longest delay between task restarts
+
+    def run_daemon(self, **opts):
+        """
+        Creates the event loop and runs handle_daemon on it until it
+        returns, then cancels any supervised tasks and closes the loop.
+        """
+        if asyncio is None:
+            raise ConsoleError("AsyncDaemonProgram requires asyncio (or trollius on Python 2)")
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.opts     = opts
+        self.shutdown = asyncio.Event()
+        self.tasks    = {}      # name -> running supervised task
+        self.task_failures = {} # name -> number of consecutive crashes
+
+        self.loop.add_signal_handler(SIGTERM, self.request_exit)
+        if self.worker_id is None:
+            self.loop.add_signal_handler(SIGHUP, self.request_reload)
+
+        self.start_consumers()
+        self.start_watchdog()
+        try:
+            self.loop.run_until_complete(self.handle_daemon(**opts))
+        finally:
+            self.request_stop()
+            tasks = list(self.tasks.values())
+            if tasks:
+                self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+            self.install_signal_handlers()
+            self.stop_consumers()
+
+    def request_recycle(self, reason):
+        super(AsyncDaemonProgram, self).request_recycle(reason)
+        loop = getattr(self, 'loop', None)
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.request_stop)
+
+    def request_stop(self):
+        """
+        Sets the shutdown event and cancels the supervised tasks.
+        """
+        self.stop_event.set()
+        self.shutdown.set()
+        for task in self.tasks.values():
+            task.cancel()
+
+    def request_exit(self):
+        """
+        Handles SIGTERM by stopping the daemon, cancelling any recycle that
+        is underway so that the daemon exits rather than re-executing.
+        """
+        self.recycle_event.clear()
+        self.request_stop()
+
+    def request_reload(self):
+        """
+        Calls handle_reload on the loop, running it as a task if it returns
+        a coroutine.
+        """
+        self.reload_event.set()
+        try:
+            result = self.handle_reload(**self.opts)
+        except Exception:
+            sys.stderr.write("Reload failed:\n")
+            traceback.print_exc()
+            return
+
+        if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+            task = asyncio.ensure_future(result)
+            task.add_done_callback(lambda task: self.report_task('reload', task))
+
+    def wait_stop(self):
+        """
+        Returns an awaitable that completes when the daemon is asked to stop.
+        """
+        return self.shutdown.wait()
+
+    def supervise(self, name, factory, *args):
+        """
+        Runs the coroutine returned by factory(*args) as a background task.
+        If it raises, the error is logged and a new coroutine is started
+        after a backoff that resets once the task has run for longer than
+        the maximum backoff. Tasks that return are not restarted.
+        """
+        if self.stopping:
+            return
+
+        started = self.loop.time()
+        task = asyncio.ensure_future(factory(*args))
+        self.tasks[name] = task
+        task.add_done_callback(lambda task: self.task_done(name, factory, args, started, task))
+        return task
+
+    def task_done(self, name, factory, args, started, task):
+        if self.tasks.get(name) is task:
+            del self.tasks[name]
+
+        if not self.report_task(name, task) or self.stopping:
+            return
+
+        if self.loop.time() - started > self.task_backoff_max:
+            self.task_failures[name] = 0
+        failures = self.task_failures.get(name, 0)
+        delay = min(self.task_backoff * (2 ** failures), self.task_backoff_max)
+        self.task_failures[name] = failures + 1
+
+        sys.stderr.write("Restarting task %s in %.1f sec.\n" % (name, delay))
+        self.loop.call_later(delay, self.supervise, name, factory, *args)
+
+    def report_task(self, name, task):
+        """
+        Logs the error a finished task raised, returning True if it did.
+        """
+        if task.cancelled():
+            return False
+
+        # Python 2 exceptions do not carry their traceback, but the task
+        # re-raises them with it from result()
+        try:
+            task.result()
+        except Exception:
+            sys.stderr.write("Task %s crashed:\n" % name)
+            traceback.print_exc()
+            return True
+        return False
 
 if __name__ == "__main__":
 
@@ -230,18 +1689,21 @@ if __name__ == "__main__":
             make_option('-w', dest='logfile', action='store', default='/dev/null', metavar='PATH', help="Path to a log file to write to."),
         )
 
-        def log(self, entry):
+        def log(self):
             with open(self.logfile, 'a+') as out:
-                out.write("This is entry number %i\n" % entry)
+                out.write("This is entry number %i\n" % self.entry)
+
+            self.entry += 1
+            if self.entry >= 100:
+                self.stop_event.set()
+                self.scheduler.wake()
 
         def handle_daemon(self, **opts):
             
             self.logfile = opts.get('logfile', '/dev/null')
+            self.entry   = 0
 
-            start = 0
-            while start < 100:
-                self.log(start)
-                start += 1 
-                time.sleep(5)
+            self.scheduler.every(5, self.log)
+            self.scheduler.run(self.stop_event)
 
     TestDaemon(pidfile="/Users/benjamin/Desktop/test.pid").load(sys.argv)
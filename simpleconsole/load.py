@@ -1,12 +1,149 @@
+import io
 import os
+import threading
 
 from base import BaseCommand, CommandError
+from optparse import make_option
+from streams import open_compressed, iter_chunks, sniff_compression
+from streams import DecompressingReader, DECOMPRESSORS, BLOCKSIZE, MAGIC_LENGTH
+
+# Not available before Python 3.3 or on platforms without the syscall
+posix_fadvise = getattr(os, 'posix_fadvise', None)
+
+class Prefetcher(object):
+    """
+    Reads the files at a list of paths on a background thread, staying at
+    most depth files ahead of the consumer and holding no more than budget
+    bytes in memory. Files that do not fit in the budget are not read, but
+    the kernel is advised to read them ahead where posix_fadvise exists.
+
+    The consumer must call take() once for each path, in order.
+    """
+
+    def __init__(self, paths, depth=2, budget=64 * 1024 * 1024):
+        self.paths  = list(paths)
+        self.depth  = depth
+        self.budget = budget
+
+        self.used     = 0      # Bytes currently held in memory
+        self.taken    = 0      # Number of paths handed to the consumer
+        self.results  = {}     # Index of path -> data or None
+        self.stopped  = False
+        self.cond     = threading.Condition()
+
+        self.thread   = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        for idx, path in enumerate(self.paths):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+
+            with self.cond:
+                # Wait until the path is within depth of the consumer and
+                # its data fits in the budget, or nothing else is held.
+                while not self.stopped and (idx - self.taken >= self.depth or
+                        (size and self.used and self.used + size > self.budget)):
+                    self.cond.wait()
+
+                if self.stopped:
+                    return
+
+                fits = size is not None and self.used + size <= self.budget
+                if fits:
+                    self.used += size
+
+            data = self.read(path, size) if fits else self.advise(path)
+
+            with self.cond:
+                if fits and data is None:
+                    self.used -= size
+                self.results[idx] = data
+                self.cond.notify_all()
+
+    def read(self, path, size):
+        """
+        Reads the entire file into memory, returning None on error so the
+        consumer reads it from disk and reports the error itself.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            return data if len(data) == size else None
+        except IOError:
+            return None
+
+    def advise(self, path):
+        """
+        Asks the kernel to start reading the file into the page cache.
+        """
+        if posix_fadvise is not None:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+        return None
+
+    def take(self):
+        """
+        Waits for the next path to be prefetched and returns its data, or
+        None if the consumer should read the file from disk.
+        """
+        with self.cond:
+            idx = self.taken
+            while idx not in self.results:
+                self.cond.wait()
+
+            data = self.results.pop(idx)
+            if data is not None:
+                self.used -= len(data)
+            self.taken += 1
+            self.cond.notify_all()
+            return data
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.results.clear()
+            self.cond.notify_all()
+        self.thread.join()
 
 class FilePathCommand(BaseCommand):
-    
+    """
+    A command which takes one or more file paths on the command line and
+    does something with each of them.
+
+    Rather than implement handle(), subclasses must implement handle_path(),
+    which will be called once for each valid path. Subclasses should read
+    the path with open_path() or read_chunks(), which transparently
+    decompress gzip, bzip2, and xz files on a background thread unless the
+    decompress attribute is set to False.
+
+    The next prefetch files are read on a background thread while the
+    current path is handled, holding no more than prefetch_budget bytes.
+    """
+
+    opts = BaseCommand.opts + (
+        make_option('--prefetch', type='int', default=None, metavar='K',
+            help='Number of files to read ahead while processing the current file'),
+        make_option('--prefetch-budget', type='int', default=None, metavar='BYTES',
+            help='Maximum number of bytes held in memory by read ahead'),
+    )
+
     args  = "<path path ...>"
     label = "path"
 
+    decompress      = True
+    prefetch        = 0
+    prefetch_budget = 64 * 1024 * 1024
+
     def check_path(self, path):
         try:
             with open(path, 'rb') as f: pass
@@ -14,21 +151,68 @@ class FilePathCommand(BaseCommand):
         except IOError:
             return False
 
+    def open_path(self, path):
+        """
+        Returns a binary file-like object for reading path, decompressing
+        the file if it is compressed and the decompress attribute is set.
+        The file is read from memory if it has been prefetched.
+        """
+        data = getattr(self, '_prefetched', {}).get(path)
+        if data is None:
+            if self.decompress:
+                return open_compressed(path)
+            return open(path, 'rb')
+
+        fobj = io.BytesIO(data)
+        kind = sniff_compression(data[:MAGIC_LENGTH])
+        if not self.decompress or kind is None:
+            return fobj
+
+        if kind not in DECOMPRESSORS:
+            raise IOError("Cannot read %s: %s support is not installed" % (path, kind))
+        return DecompressingReader(path, kind, fobj=fobj)
+
+    def read_chunks(self, path, size=BLOCKSIZE):
+        """
+        Generator that yields the (decompressed) contents of path in chunks
+        of at most size bytes.
+        """
+        with self.open_path(path) as f:
+            for chunk in iter_chunks(f, size):
+                yield chunk
+
     def handle(self, *paths, **options):
-        
+
         if not paths:
             raise CommandError("Provide at least one %s." % self.label)
 
+        prefetch = options.get('prefetch')
+        if prefetch is None: prefetch = self.prefetch
+        budget = options.get('prefetch_budget')
+        if budget is None: budget = self.prefetch_budget
+
+        checked = [(path, self.check_path(path)) for path in paths]
+        valid = [path for path, ok in checked if ok]
+        prefetcher = Prefetcher(valid, prefetch, budget) if prefetch > 0 and valid else None
+
         output = []
-        for path in paths:
+        try:
+            for path, ok in checked:
+
+                if not ok:
+                    output.append("%s is not a valid %s." % (path, self.label))
+                    continue
+
+                self._prefetched = {path: prefetcher.take()} if prefetcher else {}
 
-            if not self.check_path(path):
-                output.append("%s is not a valid %s." % (path, self.label))
-                continue
+                path_output = self.handle_path(path, **options)
+                if path_output:
+                    output.append(path_output)
+        finally:
+            self._prefetched = {}
+            if prefetcher:
+                prefetcher.stop()
 
-            path_output = self.handle_path(path, **options)
-            if path_output:
-                output.append(path_output)
         output.append("")
         return '\n'.join(output)
 
@@ -1,6 +1,9 @@
 import os
+import zlib
 
 from base import CommandError
+from streams import AtomicFile, CompressingWriter, LineWriter, WRITE_BUFFER
+from streams import COMPRESSORS, SUFFIXES, compression_for_path
 
 class ConfirmationMixin(object):
     """
@@ -66,14 +69,174 @@ class WriteOutMixin(object):
     Provide a helper function to write out to a path instead of stdout, or
     stdout otherwise. The path is checked to ensure no overwriting. Also,
     it checks an option value. 
+
+    Output is written incrementally from any iterable of lines through a
+    buffer of C{write_buffer_size} bytes, to a temporary file that is
+    atomically renamed to the path once all output has been written. The
+    C{fsync} attribute sets the fsync policy, see L{AtomicFile}.
+
+    Output to a path is compressed on a background thread if C{compress}
+    names a format (gzip, bz2, or xz), or if it is "auto" and the suffix
+    of the path is .gz, .bz2, or .xz. C{compress_level} selects the level.
+
+    Use C{write_shards()} to split the output across several files for
+    consumers that read it in parallel.
     """
 
-    def write(self, path=None, output=[]):
-        
+    write_buffer_size = WRITE_BUFFER
+    write_batch_lines = 1024
+    fsync = 'file'
+    compress = 'auto'
+    compress_level = None
+
+    def write(self, path=None, output=[], **kwargs):
+        """
+        Writes the lines of output, separated by newlines, to path or to
+        stdout if no path is given.
+
+        @param path: The path to write to, or None for stdout
+        @param output: Any iterable or generator of lines without newlines
+        @param fsync: Overrides the fsync policy of the command
+        @param compress: Overrides the compression format of the command
+        @param level: Overrides the compression level of the command
+        """
         if path is not None:
-            with open(path, 'w') as out:
-                out.write('\n'.join(output))
+            with self.open_output(path, **kwargs) as out:
+                self.write_lines(out, output)
 
         else:
             if hasattr(self, 'stdout'):
-                self.stdout.write('\n'.join(output))
+                self.write_lines(self.stdout, output)
+
+    def write_shards(self, path, output=[], shards=None, key=None,
+                     max_lines=None, max_bytes=None, **kwargs):
+        """
+        Writes the lines of output across several files named after path
+        with a shard number, e.g. C{out-00000.txt} for C{out.txt}, then
+        writes an index file (C{out.txt.index}) listing each shard and its
+        number of lines, separated by a tab.
+
+        Lines are either split across a fixed number of shards, in turn or
+        partitioned by the hash of key(line), or written to one shard until
+        it holds max_lines lines or max_bytes (uncompressed) bytes and then
+        rolled over to the next. The shards are compressed like the output
+        of L{write}, and are only renamed into place, followed by the
+        index, once all of them have been written; if output raises, the
+        previous shards and index are left as they were.
+
+        @param path: The path the shard and index paths are derived from
+        @param output: Any iterable or generator of lines without newlines
+        @param shards: The number of shards to split the lines across
+        @param key: Function of a line whose hash selects its shard
+        @param max_lines: Rolls over to a new shard after this many lines
+        @param max_bytes: Rolls over to a new shard after this many bytes
+
+        @returns: The list of paths of the shards written
+        """
+        if shards is None and not (max_lines or max_bytes):
+            raise CommandError("Specify either a number of shards or a max_lines or max_bytes limit")
+        if shards is not None and (max_lines or max_bytes):
+            raise CommandError("Cannot specify both a number of shards and a rollover limit")
+        if shards is not None and shards < 1:
+            raise CommandError("The number of shards must be at least one")
+
+        paths   = []
+        files   = []
+        writers = []
+
+        def open_shard():
+            shard_path = self.shard_path(path, len(paths))
+            out = self.open_output(shard_path, defer=True, **kwargs)
+            paths.append(shard_path)
+            files.append(out)
+            writers.append(LineWriter(out, self.write_batch_lines))
+            return writers[-1]
+
+        try:
+            if shards is not None:
+                for idx in xrange(shards):
+                    open_shard()
+
+                if key is None:
+                    for idx, line in enumerate(output):
+                        writers[idx % shards].add(line)
+                else:
+                    for line in output:
+                        # crc32 rather than hash() so partitions are stable
+                        shard = zlib.crc32(str(key(line))) % shards
+                        writers[shard].add(line)
+
+            else:
+                writer = open_shard()
+                for line in output:
+                    if writer.lines and ((max_lines and writer.lines >= max_lines) or
+                            (max_bytes and writer.bytes + len(line) + 1 > max_bytes)):
+                        writer.flush()
+                        files[-1].close()
+                        writer = open_shard()
+                    writer.add(line)
+
+            for writer, out in zip(writers, files):
+                writer.flush()
+                out.close()
+            for out in files:
+                out.commit()
+        except:
+            for out in files:
+                out.discard()
+            raise
+
+        index = ("%s\t%i" % (os.path.basename(shard_path), writer.lines)
+                 for shard_path, writer in zip(paths, writers))
+        self.write(path + '.index', index, compress=None, fsync=kwargs.get('fsync'))
+        return paths
+
+    def shard_path(self, path, idx):
+        """
+        Returns the path of shard number idx, inserting the shard number
+        before the extension and any compression suffix of path.
+        """
+        base, ext = os.path.splitext(path)
+        if ext.lower() in SUFFIXES:
+            base, inner = os.path.splitext(base)
+            ext = inner + ext
+        return "%s-%05i%s" % (base, idx, ext)
+
+    def open_output(self, path, **kwargs):
+        """
+        Opens an atomic, and possibly compressed, file for writing to path.
+        The returned file is renamed to path when closed, or removed if it
+        is discarded or used in a with block that raises an exception. With
+        defer=True it is only renamed by its commit() method.
+        """
+        fsync = kwargs.get('fsync') or self.fsync
+        kind  = self.get_compression(path, kwargs.get('compress', self.compress))
+        level = kwargs.get('level', self.compress_level)
+        defer = kwargs.get('defer', False)
+
+        out = AtomicFile(path, buffering=self.write_buffer_size, fsync=fsync, defer=defer)
+        if kind is None:
+            return out
+        return CompressingWriter(out, kind, level, closefd=True)
+
+    def get_compression(self, path, compress):
+        """
+        Returns the compression format to write path with, or None.
+        """
+        if compress == 'auto':
+            compress = compression_for_path(path)
+        if not compress or compress == 'none':
+            return None
+        if compress not in COMPRESSORS:
+            raise CommandError("Cannot write %s: %s compression is not supported" % (path, compress))
+        return compress
+
+    def write_lines(self, out, output):
+        """
+        Writes the lines of output to the file object out, separated by
+        newlines, in batches of C{write_batch_lines} lines.
+        """
+        writer = LineWriter(out, self.write_batch_lines)
+        for line in output:
+            writer.add(line)
+        writer.flush()
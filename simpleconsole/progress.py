@@ -10,13 +10,19 @@
 A class that creates a text representation of a progress bar for use in
 terminals or on command line interfaces. It does not use the carraige
 return or ANSI codes to reset the bar, but rather the Backspace (0x08) chr
-to return to the beginning of the line, and should be compatible with most
-terminals. 
+to return to the first character that changed since the last refresh, and
+should be compatible with most terminals. 
 
     >>> pb_ex = ProgressMeter(total=6000, unit='Kb', ticks=25)
 
     [=======>                ] 17%  58.2 Kb/sec. 
 
+Meters counting bytes can show the rate in binary units instead:
+
+    >>> pb_ex = ProgressMeter(total=6000000, unit='bytes', binary=True)
+
+    [=======>                ] 17% 58.2 KiB/s
+
 @author: U{Benjamin Bengfort<mailto:benjamin@bengfort.com>
 @license: PSF
 @url: U{http://code.activestate.com/recipes/473899-progress-meter/}
@@ -40,8 +46,49 @@ __docformat__ = "epytext en"
 ## Imports
 ###########################################################################
 
+import os
 import sys
+import json
+import stat
 import time
+import socket
+import threading
+import multiprocessing
+
+from itertools import islice
+from collections import deque
+from streams import AtomicFile
+
+###########################################################################
+## Helpers
+###########################################################################
+
+def format_duration(seconds):
+    """
+    Formats a number of seconds compactly, e.g. C{1h02m05s}.
+
+    @rtype: C{str}
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes   = divmod(minutes, 60)
+    if hours:
+        return '%ih%02im%02is' % (hours, minutes, seconds)
+    if minutes:
+        return '%im%02is' % (minutes, seconds)
+    return '%is' % seconds
+
+def format_bytes(value):
+    """
+    Formats a number of bytes in binary units, e.g. C{1.5 MiB}.
+
+    @rtype: C{str}
+    """
+    value = float(value)
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(value) < 1024.0:
+            return "%.1f %s" % (value, unit)
+        value /= 1024.0
+    return "%.1f PiB" % value
 
 ###########################################################################
 ## Base Progress Meter
@@ -52,6 +99,11 @@ class ProgressMeter(object):
     A simple progress meter object that can be customized in several ways
     to produce a print on the terminal or in the command line of an
     updating progress bar with units/sec and percent complete represented.
+
+    When stdout is not a terminal (e.g. it is redirected to a log file) the
+    bar is not drawn; instead a status line with the count, percentage,
+    rate and estimated time remaining is written every C{log_interval}
+    seconds, as text or as JSON if C{log_format} is "json".
     """
     
     def __init__(self, **kwargs):
@@ -64,6 +116,14 @@ class ProgressMeter(object):
         self.timestamp    = kwargs.get('timestamp', time.time())   # Start time for tracking
         self.meter_ticks  = int(kwargs.get('ticks', 60))           # The number of ticks in meter
         self.rate_refresh = float(kwargs.get('rate_refresh', .5))  # Refresh rate in seconds
+        self.tty          = kwargs.get('tty', None)                # Draw the bar, or log status lines
+        self.log_interval = float(kwargs.get('log_interval', 30))  # Seconds between status lines
+        self.log_format   = str(kwargs.get('log_format', 'text'))  # Format of status lines, text or json
+        self.binary       = bool(kwargs.get('binary', False))      # Show the rate in KiB/s, MiB/s, etc.
+
+        if self.tty is None:
+            isatty   = getattr(self.stdout, 'isatty', None)
+            self.tty = bool(isatty and isatty())
 
         # Add calculated properties
         self.meter_division = float(self.total) / self.meter_ticks
@@ -71,12 +131,15 @@ class ProgressMeter(object):
 
         # Add non customizable properties
         self.last_update      = None
+        self.update_gap       = None    # Seconds between the last two updates
+        self.finished         = None    # Time the count reached the total
         self.rate_history_idx = 0
         self.rate_history_len = 10
         self.rate_history     = [None] * self.rate_history_len
         self.rate_current     = 0.0
         self.last_refresh     = 0
-        self.prev_meter_len   = 0
+        self.last_frame       = ''
+        self.last_log         = 0
         self.switch_off       = False
 
     #//////////////////////////////////////////////////////////////////////
@@ -129,6 +192,7 @@ class ProgressMeter(object):
         # Calculate Rate of Progress
         if self.last_update:
             delta = now - float(self.last_update)
+            self.update_gap = delta
             if delta:
                 rate = count / delta
             else:
@@ -149,6 +213,8 @@ class ProgressMeter(object):
             rate = total / cnt
         self.rate_current = rate
         self.last_update  = now
+        if self.finished is None and self.completed:
+            self.finished = now
 
         # Device Total by Meter Division
         value = int(self.count / self.meter_division)
@@ -218,9 +284,73 @@ class ProgressMeter(object):
         timestamp    = kwargs.get('timestamp', None)
         meter_ticks  = int(kwargs.get('ticks', self.meter_ticks)) 
         rate_refresh = float(kwargs.get('rate_refresh', self.rate_refresh))
+        tty          = kwargs.get('tty', self.tty)
+        log_interval = float(kwargs.get('log_interval', self.log_interval))
+        log_format   = str(kwargs.get('log_format', self.log_format))
+        binary       = bool(kwargs.get('binary', self.binary))
+
+        self.__init__(unit=unit, total=total, count=count, stdout=stdout,
+                      timestamp=timestamp, ticks=meter_ticks, rate_refresh=rate_refresh,
+                      tty=tty, log_interval=log_interval, log_format=log_format,
+                      binary=binary)
 
-        self.__init__(unit=unt, total=total, count=count, stdout=stdout,
-                      timestamp=timestamp, ticks=meter_ticks, rate_refresh=rate_refresh)
+    def wrap(self, iterable, total=None, every=None, interval=None, max_batch=1024):
+        """
+        Generator that yields the items of iterable, updating the meter as
+        each item is consumed. The total is taken from len(iterable) when
+        it is not given and the iterable has a length.
+
+        Updates are batched so that the meter is not called for each item:
+        either every N items, or by default with a batch size that adapts
+        so the meter is updated about every interval seconds (by default
+        the refresh rate of the meter). The time is only checked when a
+        batch is flushed, not per item, so the adaptive batch is capped at
+        max_batch items (and at one tick of the bar) to bound how late an
+        update can be when the items slow down after a fast phase.
+
+            >>> for row in meter.wrap(rows):
+            ...     process(row)
+
+        @param iterable: The items to yield
+        @param total: The number of items, if not the length of iterable
+        @param every: The number of items per update of the meter
+        @param interval: The target number of seconds between updates
+        @param max_batch: The largest adaptive number of items per update
+        """
+        if total is None:
+            try:
+                total = len(iterable)
+            except TypeError:
+                pass
+        if total:
+            self._set_total(total)
+
+        interval = self.rate_refresh if interval is None else float(interval)
+        update   = self.update
+        batch    = every or 1
+        largest  = max(1, min(max_batch, self.total // self.meter_ticks))
+        pending  = 0
+        last     = time.time()
+
+        try:
+            for item in iterable:
+                yield item
+                pending += 1
+                if pending >= batch:
+                    update(pending)
+                    pending = 0
+
+                    if not every:
+                        now = time.time()
+                        elapsed, last = now - last, now
+                        if elapsed < interval / 2:
+                            batch = min(batch * 2, largest)
+                        elif elapsed > interval * 2 and batch > 1:
+                            # Shrink to the batch that would have been on time
+                            batch = max(1, int(batch * interval / elapsed))
+        finally:
+            if pending:
+                update(pending)
 
     def refresh(self, **kwargs):
         """
@@ -234,47 +364,197 @@ class ProgressMeter(object):
         if self.switch_off:
             return
 
-        # Clear line and return cursor to start-of-line
-        self._clear_meter()
-        # Get meter text
+        if not self.tty:
+            self._log_status()
+            return
+
+        # Get meter text and the changes to the frame on the terminal
         meter_text = self._get_meter(**kwargs)
-        # Write meter and return cursor to start-of-line
-        self.stdout.write(meter_text)
-        self._cursor_to_start()
+        repaint = self._repaint(meter_text)
 
         # Check if we're finished
         if self.completed:
-            self.stdout.write('\n')
+            repaint += '\n'
+            self.last_frame = ''
             # Prevent refreshing after we're over a 100%, a safety measure
             # for loops that continue beyond ProgressMeter.set(100) or 
             # ProgressMeter.update(total)
             self.switch_off = True
-        self.stdout.flush()
+
+        # Skip the write entirely if the frame has not changed
+        if repaint:
+            self.stdout.write(repaint)
+            self.stdout.flush()
 
         self.last_refresh = time.time()
 
+    def publish(self, **kwargs):
+        """
+        Starts publishing the status of the meter for external monitoring,
+        see L{ProgressTelemetry} for the keyword arguments.
+
+        @returns: The started L{ProgressTelemetry}
+        """
+        telemetry = ProgressTelemetry(self, **kwargs)
+        telemetry.start()
+        return telemetry
+
+    def status(self):
+        """
+        Returns the state of the meter as a dictionary of the count, total,
+        percent, rate (units per second), unit, elapsed seconds and the
+        estimated seconds remaining (None until there is a rate).
+
+        @rtype: C{dict}
+        """
+        return {
+            'count':   self.count,
+            'total':   self.total,
+            'percent': round(self.percentage, 1),
+            'rate':    round(self.rate_current, 1),
+            'unit':    self.unit,
+            'elapsed': round((self.finished or time.time()) - self.timestamp, 1) if self.timestamp else None,
+            'eta':     self._estimated_seconds(),
+        }
+
     #//////////////////////////////////////////////////////////////////////
     # Internal helper Methods
     #//////////////////////////////////////////////////////////////////////
 
-    def _clear_meter(self):
+    def _estimated_seconds(self):
+        """
+        Estimates the seconds remaining from the current rate.
+
+        @rtype: C{int}
+        """
+        if self.completed:
+            return 0
+        if self.rate_current > 0:
+            return int((self.total - self.count) / self.rate_current)
+        return None
+
+    def _log_status(self):
         """
-        Writes spaces to the terminal and then backspaces to the beginning
-        of the line -- any method should be able to call this, not just
-        refresh.
+        Writes a status line if log_interval seconds have passed since the
+        last one, or the meter has completed, in place of drawing the bar.
 
         @returns: None
         """
-        # Write spaces to blank out the line
-        clearstr = " " * self.prev_meter_len
-        self.stdout.write(clearstr)
+        now = time.time()
+        if self.completed or not self.last_log or now - self.last_log >= self.log_interval:
+            self.stdout.write(self._get_status_line() + '\n')
+            self.stdout.flush()
+            self.last_log = now
+
+            if self.completed:
+                self.switch_off = True
+
+        self.last_refresh = now
+
+    def _get_status_line(self):
+        """
+        Formats the status of the meter as a single line for a log.
+
+        @rtype: C{str}
+        """
+        status = self.status()
+        if self.log_format == 'json':
+            return json.dumps(status, sort_keys=True)
+
+        line = "%i/%i %.1f%% %s" % (status['count'], status['total'], status['percent'],
+                                     self._format_rate())
+        if status['eta'] is not None and not self.completed:
+            line += " eta %s" % format_duration(status['eta'])
+        elif status['elapsed'] is not None and self.completed:
+            line += " elapsed %s" % format_duration(status['elapsed'])
+        return line
+
+
+    def _set_total(self, total):
+        """
+        Changes the total of the meter and recalculates the meter division.
 
-        # Return the cursor to the beginning of the line
-        self._cursor_to_start()
+        @param total: The new number of units to process
+        @type total: C{int}
+
+        @returns: None
+        """
+        self.total = int(total)
+        self.meter_division = float(self.total) / self.meter_ticks
+        self.meter_value    = int(self.count / self.meter_division)
+
+    def _repaint(self, meter_text):
+        """
+        Returns the text that turns the last frame written to the terminal
+        into meter_text, leaving the cursor at the end of the new frame.
+        Only the characters after the prefix the frames have in common are
+        rewritten: the cursor backspaces to the first changed character,
+        writes the new suffix, and blanks out any leftover characters of a
+        longer last frame. An unchanged frame results in an empty string.
+
+        @param meter_text: The new frame to display
+        @type meter_text: C{str}
+
+        @returns: The text to write to the terminal
+        @rtype: C{str}
+        """
+        prev = self.last_frame
+        if meter_text == prev:
+            return ''
+
+        # Length of the common prefix, by bisection on slice comparisons
+        common, limit = 0, min(len(prev), len(meter_text))
+        while common < limit:
+            mid = (common + limit + 1) // 2
+            if prev[:mid] == meter_text[:mid]:
+                common = mid
+            else:
+                limit = mid - 1
+
+        repaint = '\x08' * (len(prev) - common) + meter_text[common:]
+        excess  = len(prev) - len(meter_text)
+        if excess > 0:
+            repaint += ' ' * excess + '\x08' * excess
+
+        self.last_frame = meter_text
+        return repaint
+
+    def _idle_rate(self, now=None):
+        """
+        Returns the current rate, lowered in proportion to how long the
+        meter has gone without an update beyond the gap between its last
+        two updates, so that a stalled meter shows a falling rate rather
+        than the rate it last had.
+
+        @rtype: C{float}
+        """
+        rate = self.rate_current
+        if self.completed or not self.update_gap:
+            return rate
+
+        idle = (now or time.time()) - self.last_update
+        if idle > self.update_gap:
+            rate *= self.update_gap / idle
+        return rate
+
+    def _format_rate(self, rate=None):
+        """
+        Formats the current rate, or the given rate, as units per second,
+        or in binary units of bytes per second (e.g. 1.2 MiB/s) if the
+        binary flag is set.
+
+        @rtype: C{str}
+        """
+        if rate is None:
+            rate = self.rate_current
+        if self.binary:
+            return "%s/s" % format_bytes(rate)
+        return "%.1f %s/sec." % (rate, self.unit)
 
     def _get_meter(self, **kwargs):
         """
-        Creates the meter and the bar for display. 
+        Creates the meter and the bar for display. The rate shown can be
+        passed as the rate keyword argument.
 
         @todo: Allow bar and pad chr to be passed in kwargs.
 
@@ -289,27 +569,10 @@ class ProgressMeter(object):
             meter_text = "[%s=%s] %d%%" % (bar, pad, pct)
         else:
             pad = '-' * (self.meter_ticks - self.meter_value)
-            meter_text = "[%s>%s] %d%% %.1f %s/sec." % (bar, pad, pct, self.rate_current, self.unit)
+            meter_text = "[%s>%s] %d%% %s" % (bar, pad, pct, self._format_rate(kwargs.get('rate')))
         
-        # Update the prev_meter_len value for other methods
-        self.prev_meter_len = len(meter_text)
-
         return meter_text
 
-    def _cursor_to_start(self, length=None):
-        """
-        Returns the cursor to the start of the line in the terminal, using
-        the C{prev_meter_len} by default as the number of backspaces, or
-        the optional length parameter that can be passed into the method.
-
-        @param length: The number of backspaces to add.
-        @type length: C{int}
-
-        @returns: None
-        """
-        length = length or self.prev_meter_len
-        self.stdout.write('\x08' * length)
-
     #//////////////////////////////////////////////////////////////////////
     # Object Overrides
     #//////////////////////////////////////////////////////////////////////
@@ -329,11 +592,16 @@ class TimedProgressMeter(ProgressMeter):
     A progress meter that provides an estimate of the time remaining based
     on the rate of the progress updates, and when complete, prints the 
     total time it took to reach 100%.
+
+    Only the most recent C{estimate_history} estimates of the remaining
+    time are kept, since no more than that many are weighted together.
     """
 
+    estimate_history = 50
+
     def __init__(self, **kwargs):
         super(TimedProgressMeter, self).__init__(**kwargs)
-        self.estimated_duration = []
+        self.estimated_duration = deque(maxlen=self.estimate_history)
 
     #//////////////////////////////////////////////////////////////////////
     # Methods
@@ -394,9 +662,6 @@ class TimedProgressMeter(ProgressMeter):
             
         meter_text = " ".join((meter_text, time_str))
         
-        # Update the prev_meter_len value for other methods
-        self.prev_meter_len = len(meter_text)
-
         return meter_text
 
     def _completion_time(self):
@@ -407,8 +672,8 @@ class TimedProgressMeter(ProgressMeter):
         @returns: The string representation of the completion time.
         @rtype: C{str}
         """
-        # Time delta (duration)
-        dur = time.time() - self.timestamp
+        # Time delta (duration), up to when the meter completed
+        dur = (self.finished or time.time()) - self.timestamp
 
         # Convert to hours, minutes, and seconds
         hours, remainder = divmod(dur, 3600)
@@ -424,15 +689,16 @@ class TimedProgressMeter(ProgressMeter):
             else:
                 return 'completed in %.f hours %.f min %.f sec.' % (hours, minutes, seconds)
 
-    def _estimated_time(self):
+    def _estimated_seconds(self):
         """
-        Calculates the estimated time remaining based on the refresh rate
-        and the current duration, as well as the estimated durations. Then
-        returns the string that formats the estimated time correctly.
+        Calculates the estimated seconds remaining as a weighted average
+        of the most recent estimated durations, or None if there are none.
 
-        @returns: The string representation of the estimated time.
-        @rtype: C{str}
+        @rtype: C{int}
         """
+        if self.completed:
+            return 0
+
         if len(self.estimated_duration) >= 1:
             # parameters to refine time-remaining estimation
             last_estimate = self.estimated_duration[-1]
@@ -441,13 +707,30 @@ class TimedProgressMeter(ProgressMeter):
             elif last_estimate >= 30 and last_estimate < 90: exp = 1.25; dat = 50
             else: exp = 1.00; dat = 50
 
-            # Calculation of time-remaining estimation
+            # Calculation of time-remaining estimation, weighting the last
+            # dat estimates so the most recent ones count the most
+            recent = list(islice(reversed(self.estimated_duration), dat))
+            recent.reverse()
+
             wght_num, wght_den = (0, 0)
-            for i in xrange(0, min(len(self.estimated_duration), dat)):
-                wght_num += self.estimated_duration[-dat:][i] * ((i+1)**exp)
+            for i, estimate in enumerate(recent):
+                wght_num += estimate * ((i+1)**exp)
                 wght_den += (i+1)**exp
-            est_dur = int(wght_num / wght_den)
+            return int(wght_num / wght_den)
+
+        return None
+
+    def _estimated_time(self):
+        """
+        Calculates the estimated time remaining based on the refresh rate
+        and the current duration, as well as the estimated durations. Then
+        returns the string that formats the estimated time correctly.
 
+        @returns: The string representation of the estimated time.
+        @rtype: C{str}
+        """
+        est_dur = self._estimated_seconds()
+        if est_dur is not None:
             # Convert into hours, minutes, and seconds
             hours, remainder = divmod(est_dur, 3600)
             minutes, seconds = divmod(remainder, 60)
@@ -465,6 +748,786 @@ class TimedProgressMeter(ProgressMeter):
             return "Calculating time remaining..."
 
 
+###########################################################################
+## Background Rendering Progress Meters
+###########################################################################
+
+class BackgroundMeterMixin(object):
+    """
+    Moves the work of a progress meter onto a background ticker thread, so
+    that update() only adds to a pending counter. Every interval seconds
+    the ticker samples the counter and passes the difference to the
+    update() of the progress meter this is mixed into, which computes the
+    rate and refreshes the bar. Use this for tight loops of many updates,
+    where the per-update cost of the regular meters becomes noticeable.
+
+    The ticker starts when the meter is created and stops by itself once
+    the total is reached; call stop() if the loop finishes early. Calling
+    reset() stops the ticker and starts a new one for the new operation.
+    """
+
+    def __init__(self, **kwargs):
+        super(BackgroundMeterMixin, self).__init__(**kwargs)
+        interval = getattr(self, 'interval', None) or self.rate_refresh
+        self.interval = float(kwargs.get('interval', interval))
+        self.pending  = self.count      # Incremented by update
+        self.sampled  = self.count      # Pending count at the last tick
+        self.stopped  = threading.Event()
+        self.ticker   = threading.Thread(target=self._run_ticker)
+        self.ticker.daemon = True
+        self.ticker.start()
+
+    #//////////////////////////////////////////////////////////////////////
+    # Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def update(self, count=1, **kwargs):
+        """
+        Adds count to the pending counter, which the ticker thread samples
+        to update the meter.
+
+        @param count: The value to increase the internal count by
+        @type count: C{int}
+
+        @returns: None
+        """
+        self.pending += count
+
+    def set(self, count=None, percent=None, **kwargs):
+        """
+        Sets the pending counter to count, or to the count that is closest
+        to the given percentage of the total.
+
+        @returns: None
+        @raises: C{ValueError}
+        """
+        if count and percent:
+            raise ValueError("Cannot specify both count and percent")
+        elif count is not None:
+            self.pending = min(count, self.total)
+        elif percent is not None:
+            self.pending = min(int((float(percent) / 100) * self.total), self.total)
+        else:
+            raise ValueError("Specify either count or percent to set")
+
+    def tick(self):
+        """
+        Samples the pending counter and updates the meter with the change
+        since the last tick. Called by the ticker thread.
+
+        @returns: None
+        """
+        value = self._sample()
+        delta = value - self.sampled
+        if delta:
+            self.sampled = value
+            super(BackgroundMeterMixin, self).update(delta)
+
+    def stop(self):
+        """
+        Stops the ticker thread, then applies the final count and writes
+        the meter a last time.
+
+        @returns: None
+        """
+        self._stop_ticker()
+        self.tick()
+        self.refresh()
+
+    def reset(self, **kwargs):
+        """
+        Stops the ticker thread of the current operation, then resets the
+        meter, which starts a new ticker. The interval is kept unless it
+        is passed as a keyword argument.
+
+        @returns: None
+        """
+        self._stop_ticker()
+        if 'interval' in kwargs:
+            self.interval = float(kwargs['interval'])
+        super(BackgroundMeterMixin, self).reset(**kwargs)
+
+    #//////////////////////////////////////////////////////////////////////
+    # Internal Helper Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def _sample(self):
+        """
+        Returns the current count to update the meter to.
+        """
+        return self.pending
+
+    def _stop_ticker(self):
+        self.stopped.set()
+        if self.ticker.is_alive() and self.ticker is not threading.current_thread():
+            self.ticker.join()
+
+    def _run_ticker(self):
+        while not self.stopped.wait(self.interval):
+            self.tick()
+            if self.completed:
+                break
+
+class BackgroundProgressMeter(BackgroundMeterMixin, ProgressMeter):
+    """
+    A L{ProgressMeter} that is sampled and rendered on a background thread.
+    """
+    pass
+
+class BackgroundTimedProgressMeter(BackgroundMeterMixin, TimedProgressMeter):
+    """
+    A L{TimedProgressMeter} that is sampled and rendered on a background
+    thread.
+    """
+    pass
+
+###########################################################################
+## Multiprocess Progress Meters
+###########################################################################
+
+class SharedCounter(object):
+    """
+    A counter in shared memory that worker processes add to, made of one
+    slot per worker plus a locked slot for workers that don't have one.
+    A worker that adds to its own slot needs no lock because it is the
+    only writer of that slot; the value of the counter is the sum of all
+    of the slots.
+
+    The counter must be handed to the workers when they are started, e.g.
+    as an argument to C{multiprocessing.Process} or to the initializer of
+    a C{multiprocessing.Pool}.
+    """
+
+    def __init__(self, slots=None):
+        self.slots  = int(slots or multiprocessing.cpu_count())
+        self.values = multiprocessing.RawArray('L', self.slots + 1)
+        self.lock   = multiprocessing.Lock()
+
+    def add(self, count=1, slot=None):
+        """
+        Adds count to the counter, to the given slot without locking, or
+        otherwise to the shared slot while holding the lock.
+
+        @param count: The value to increase the counter by
+        @param slot: The index of the slot owned by this worker
+        """
+        if slot is None:
+            with self.lock:
+                self.values[self.slots] += count
+        else:
+            self.values[slot] += count
+
+    @property
+    def value(self):
+        """
+        The sum of the slots of the counter.
+
+        @rtype: C{int}
+        """
+        return sum(self.values)
+
+class SharedMeterMixin(BackgroundMeterMixin):
+    """
+    Keeps the count of a progress meter in a L{SharedCounter} so that
+    worker processes can update it, while the ticker thread of the parent
+    process samples the aggregated count and is the only one to render.
+    Rate and time estimates are therefore based on the total throughput
+    of all of the workers.
+
+    Pass a counter as the C{counter} keyword argument, or the number of
+    worker C{slots} for a new one, then hand C{meter.counter} to the
+    workers, which call C{counter.add(count, slot)}. The counter is kept
+    when the meter is reset, so the workers can go on adding to it.
+    """
+
+    def __init__(self, **kwargs):
+        counter = kwargs.get('counter') or getattr(self, 'counter', None)
+        self.counter = counter or SharedCounter(kwargs.get('slots'))
+        super(SharedMeterMixin, self).__init__(**kwargs)
+
+        # Count from the current value of a counter kept by reset()
+        self.pending -= self.counter.value
+
+    def update(self, count=1, slot=None, **kwargs):
+        """
+        Adds count to the shared counter, for use in the parent process.
+
+        @returns: None
+        """
+        self.counter.add(count, slot)
+
+    def set(self, count=None, percent=None, **kwargs):
+        """
+        Sets the count of the meter to count, or to the count closest to
+        the given percentage of the total, by offsetting the pending count
+        of the parent process from the shared counter. Workers continue to
+        add to the shared counter from the new count.
+
+        @returns: None
+        @raises: C{ValueError}
+        """
+        super(SharedMeterMixin, self).set(count=count, percent=percent)
+        self.pending -= self.counter.value
+
+    def _sample(self):
+        return self.counter.value + self.pending
+
+class SharedProgressMeter(SharedMeterMixin, ProgressMeter):
+    """
+    A L{ProgressMeter} whose count is shared by several processes.
+    """
+    pass
+
+class SharedTimedProgressMeter(SharedMeterMixin, TimedProgressMeter):
+    """
+    A L{TimedProgressMeter} whose count is shared by several processes.
+    """
+    pass
+
+###########################################################################
+## Multiple Progress Meters
+###########################################################################
+
+class ProgressGroup(object):
+    """
+    Renders several progress meters at once, one per line, followed by a
+    line for the overall total of all of the meters, e.g. to show the
+    throughput of each worker of a parallel job. The meters of the group
+    do not write to the terminal themselves; instead the group repaints
+    the lines that have changed since the last refresh, moving the cursor
+    with ANSI escape codes, in a single write.
+
+    Call refresh() to repaint the group, or start() to have a background
+    thread repaint it every interval seconds until stop() is called.
+
+    As with L{ProgressMeter}, when stdout is not a terminal nothing is
+    repainted; instead a status line for each meter and the total is
+    written every C{log_interval} seconds, and when the group is stopped.
+    Meters are left out once a line showing them completed is written.
+
+        >>> group = ProgressGroup()
+        >>> workers = [group.add(ProgressMeter(total=100), 'worker %i' % i)
+        ...            for i in xrange(4)]
+    """
+
+    def __init__(self, **kwargs):
+        self.stdout   = kwargs.get('stdout', sys.stdout)
+        self.interval = float(kwargs.get('interval', .5))
+        self.unit     = str(kwargs.get('unit', 'operations'))
+        self.label    = str(kwargs.get('label', 'total'))
+        self.tty      = kwargs.get('tty', None)
+        self.log_interval = float(kwargs.get('log_interval', 30))
+        self.meters   = []      # Pairs of labels and meters
+        self.frame    = []      # The lines written by the last refresh
+        self.logged   = set()   # Ids of meters logged as completed
+        self.last_log = 0
+        self.lock     = threading.Lock()
+        self.stopped  = threading.Event()
+        self.ticker   = None
+
+        if self.tty is None:
+            isatty   = getattr(self.stdout, 'isatty', None)
+            self.tty = bool(isatty and isatty())
+
+        self.total_meter = ProgressMeter(unit=self.unit, total=1,
+                                         ticks=kwargs.get('ticks', 60),
+                                         log_format=kwargs.get('log_format', 'text'))
+        self.total_meter.switch_off = True
+
+    #//////////////////////////////////////////////////////////////////////
+    # Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def add(self, meter, label=None):
+        """
+        Adds a meter to the group, below the meters already added.
+
+        @param meter: The progress meter to display in the group
+        @param label: The label displayed before the meter
+
+        @returns: The meter that was added
+        """
+        with self.lock:
+            meter.switch_off = True
+            if label is None:
+                label = str(len(self.meters) + 1)
+            self.meters.append((str(label), meter))
+        return meter
+
+    def refresh(self):
+        """
+        Renders the meters and writes the lines that have changed since
+        the last refresh to stdout, or writes the status lines if stdout
+        is not a terminal and log_interval seconds have passed.
+
+        @returns: None
+        """
+        if not self.tty:
+            self._log_status()
+            return
+
+        with self.lock:
+            lines = self._get_lines()
+            text  = self._repaint(self.frame, lines)
+            self.frame = lines
+
+        if text:
+            self.stdout.write(text)
+            self.stdout.flush()
+
+    def start(self):
+        """
+        Starts a background thread that refreshes the group every interval
+        seconds.
+
+        @returns: None
+        """
+        if self.ticker is None:
+            self.ticker = threading.Thread(target=self._run_ticker)
+            self.ticker.daemon = True
+            self.ticker.start()
+
+    def stop(self):
+        """
+        Stops the background thread, if started, and refreshes the group a
+        final time.
+
+        @returns: None
+        """
+        self.stopped.set()
+        if self.ticker is not None:
+            self.ticker.join()
+            self.ticker = None
+
+        if self.tty:
+            self.refresh()
+        else:
+            self._log_status(force=True)
+
+    #//////////////////////////////////////////////////////////////////////
+    # Internal Helper Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def _get_lines(self):
+        """
+        Returns the labelled meter lines and the line for the total.
+
+        @rtype: C{list}
+        """
+        labels = [label for label, _ in self.meters] + [self.label]
+        width  = max(len(label) for label in labels)
+
+        # Rates of stalled meters fall off rather than stay at their last
+        now    = time.time()
+        rates  = [meter._idle_rate(now) for _, meter in self.meters]
+
+        lines  = []
+        for (label, meter), rate in zip(self.meters, rates):
+            lines.append("%s %s" % (label.ljust(width), meter._get_meter(rate=rate)))
+
+        self._update_total(rates)
+        lines.append("%s %s" % (self.label.ljust(width), self.total_meter._get_meter()))
+
+        return lines
+
+    def _update_total(self, rates):
+        """
+        Sets the total meter to the sum of the meters, given their rates.
+
+        @returns: None
+        """
+        total = self.total_meter
+        total.total = max(sum(meter.total for _, meter in self.meters), 1)
+        total.count = min(sum(meter.count for _, meter in self.meters), total.total)
+        total.rate_current   = sum(rate for (_, meter), rate in zip(self.meters, rates)
+                                   if not meter.completed)
+        total.meter_division = float(total.total) / total.meter_ticks
+        total.meter_value    = int(total.count / total.meter_division)
+
+    def _log_status(self, force=False):
+        """
+        Writes a status line for each meter that has not been logged as
+        completed, and one for the total, if log_interval seconds have
+        passed since the last ones or force is set.
+
+        @returns: None
+        """
+        now = time.time()
+        with self.lock:
+            if not force and self.last_log and now - self.last_log < self.log_interval:
+                return
+            self.last_log = now
+
+            labels = [label for label, _ in self.meters] + [self.label]
+            width  = max(len(label) for label in labels)
+            rates  = [meter._idle_rate(now) for _, meter in self.meters]
+
+            lines  = []
+            for label, meter in self.meters:
+                if id(meter) in self.logged:
+                    continue
+                if meter.completed:
+                    self.logged.add(id(meter))
+                lines.append(self._get_status_line(label, meter, width))
+
+            self._update_total(rates)
+            lines.append(self._get_status_line(self.label, self.total_meter, width))
+
+        self.stdout.write(''.join(line + '\n' for line in lines))
+        self.stdout.flush()
+
+    def _get_status_line(self, label, meter, width):
+        """
+        Formats the status line of a meter with its label, which is added
+        to the status of meters that log JSON.
+
+        @rtype: C{str}
+        """
+        if meter.log_format == 'json':
+            status = meter.status()
+            status['label'] = label
+            return json.dumps(status, sort_keys=True)
+        return "%s %s" % (label.ljust(width), meter._get_status_line())
+
+    def _repaint(self, prev, lines):
+        """
+        Returns the text that turns the previous frame into the new lines.
+        The cursor is kept at the start of the line below the frame; it is
+        moved to each changed line, which is cleared and rewritten, and
+        then back below the frame. Lines beyond the previous frame are appended.
+
+        @rtype: C{str}
+        """
+        out = []
+        pos = len(prev)
+
+        for idx, line in enumerate(lines[:len(prev)]):
+            if line == prev[idx]:
+                continue
+            if idx < pos:
+                out.append('\x1b[%iA' % (pos - idx))
+            elif idx > pos:
+                out.append('\x1b[%iB' % (idx - pos))
+            out.append('\r\x1b[2K%s\n' % line)
+            pos = idx + 1
+
+        if pos < len(prev):
+            out.append('\x1b[%iB' % (len(prev) - pos))
+
+        for line in lines[len(prev):]:
+            out.append('%s\n' % line)
+
+        return ''.join(out)
+
+    def _run_ticker(self):
+        while not self.stopped.wait(self.interval):
+            self.refresh()
+
+    #//////////////////////////////////////////////////////////////////////
+    # Object Overrides
+    #//////////////////////////////////////////////////////////////////////
+
+    def __repr__(self):
+        return "<%s: %i meters>" % (self.__class__.__name__, len(self.meters))
+
+###########################################################################
+## Byte Stream Progress
+###########################################################################
+
+class ProgressFile(object):
+    """
+    Wraps a readable or writable file object so that a progress meter is
+    updated with the number of bytes passed through read(), readinto(),
+    readline(), iteration, write() and writelines(). The meter is updated
+    in batches of at least batch bytes rather than on every call, so the
+    wrapper can be used in tight copy loops.
+
+    If no meter is given, a L{TimedProgressMeter} showing the rate in
+    binary units is created, whose total is the number of bytes left to
+    read according to fstat(), or the given total when writing or reading
+    from a pipe. A meter for an empty file completes at the end of the
+    file or when it is closed. Other attributes are passed through to the
+    wrapped file.
+
+        >>> with ProgressFile(open('dump.sql', 'rb')) as f:
+        ...     shutil.copyfileobj(f, dst)
+    """
+
+    def __init__(self, fobj, meter=None, total=None, batch=256 * 1024, **kwargs):
+        self.fobj    = fobj
+        self.batch   = batch
+        self.pending = 0
+        self.empty   = False    # Complete the meter at the end of the file
+
+        if meter is None:
+            if total is None:
+                total = self._get_total()
+            if total is None:
+                raise ValueError("Cannot determine the size of %r, specify the total" % fobj)
+
+            kwargs.setdefault('unit', 'bytes')
+            kwargs.setdefault('binary', True)
+            meter = TimedProgressMeter(total=max(total, 1), **kwargs)
+            self.empty = total == 0
+
+        self.meter = meter
+
+    #//////////////////////////////////////////////////////////////////////
+    # File Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def read(self, *args):
+        data = self.fobj.read(*args)
+        self._add(len(data), not data)
+        return data
+
+    def readinto(self, buf):
+        size = self.fobj.readinto(buf)
+        self._add(size or 0, not size)
+        return size
+
+    def readline(self, *args):
+        line = self.fobj.readline(*args)
+        self._add(len(line), not line)
+        return line
+
+    def readlines(self, *args):
+        lines = self.fobj.readlines(*args)
+        self._add(sum(len(line) for line in lines), True)
+        return lines
+
+    def write(self, data):
+        result = self.fobj.write(data)
+        self._add(len(data))
+        return result
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self._flush()
+        self.fobj.flush()
+
+    def close(self):
+        """
+        Updates the meter with the remaining bytes and closes the file.
+        """
+        self._flush(True)
+        self.fobj.close()
+
+    #//////////////////////////////////////////////////////////////////////
+    # Internal Helper Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def _add(self, size, eof=False):
+        self.pending += size
+        if eof or self.pending >= self.batch:
+            self._flush(eof)
+
+    def _flush(self, eof=False):
+        if self.pending:
+            self.meter.update(self.pending)
+            self.pending = 0
+        if eof and self.empty:
+            self.empty = False
+            self.meter.update(self.meter.total)
+
+    def _get_total(self):
+        """
+        Returns the number of bytes between the current position and the
+        end of a regular file opened for reading, or None if it can't be
+        determined, e.g. for pipes, sockets and files being written.
+        """
+        if 'r' not in getattr(self.fobj, 'mode', ''):
+            return None
+
+        try:
+            info = os.fstat(self.fobj.fileno())
+            if not stat.S_ISREG(info.st_mode):
+                return None
+            return max(info.st_size - self.fobj.tell(), 0)
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+
+    #//////////////////////////////////////////////////////////////////////
+    # Object Overrides
+    #//////////////////////////////////////////////////////////////////////
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.fobj, name)
+
+    def __repr__(self):
+        return "<%s: %r>" % (self.__class__.__name__, self.fobj)
+
+###########################################################################
+## Progress Telemetry
+###########################################################################
+
+class ProgressTelemetry(object):
+    """
+    Publishes the status of a progress meter every interval seconds from a
+    background thread, so that headless jobs can be monitored without
+    scraping their terminal output. The status can be published to any of:
+
+    status_file
+        A JSON document that is atomically replaced on each publish.
+
+    socket
+        The path of a Unix datagram socket that a JSON document is sent
+        to; nothing is sent if no one is listening.
+
+    prometheus
+        A file in the Prometheus text exposition format, for the textfile
+        collector of the node exporter, also atomically replaced.
+
+    The status has the count, total, percent, rate, unit, elapsed and eta
+    of the meter, with the job name, the pid and the start time added.
+    """
+
+    metrics = (
+        ('count',   'count',              'Number of units processed'),
+        ('total',   'total',              'Number of units to process'),
+        ('rate',    'rate',               'Units processed per second'),
+        ('eta',     'eta_seconds',        'Estimated seconds remaining'),
+        ('started', 'start_time_seconds', 'Unix time the job started'),
+        ('updated', 'updated_seconds',    'Unix time of this status'),
+    )
+
+    def __init__(self, meter, **kwargs):
+        self.meter       = meter
+        self.name        = str(kwargs.get('name', os.path.basename(sys.argv[0]) or 'progress'))
+        self.interval    = float(kwargs.get('interval', 5))
+        self.status_file = kwargs.get('status_file', None)
+        self.socket_path = kwargs.get('socket', None)
+        self.prometheus  = kwargs.get('prometheus', None)
+        self.prefix      = str(kwargs.get('prefix', 'progress'))
+
+        self.sock        = None
+        self.stopped     = threading.Event()
+        self.thread      = None
+
+        if self.socket_path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    #//////////////////////////////////////////////////////////////////////
+    # Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def status(self):
+        """
+        Returns the status of the meter with the job information added.
+
+        @rtype: C{dict}
+        """
+        status = self.meter.status()
+        status.update({
+            'name':    self.name,
+            'pid':     os.getpid(),
+            'started': self.meter.timestamp,
+            'updated': round(time.time(), 3),
+        })
+        return status
+
+    def publish(self):
+        """
+        Publishes the current status to each of the configured targets.
+
+        @returns: None
+        """
+        status = self.status()
+
+        if self.status_file:
+            with AtomicFile(self.status_file, fsync='none') as out:
+                out.write(json.dumps(status, sort_keys=True) + '\n')
+
+        if self.sock is not None:
+            try:
+                self.sock.sendto(json.dumps(status, sort_keys=True), self.socket_path)
+            except socket.error:
+                # No listener, or its buffer is full; try again next time
+                pass
+
+        if self.prometheus:
+            with AtomicFile(self.prometheus, fsync='none') as out:
+                out.write(self._get_prometheus(status))
+
+    def start(self):
+        """
+        Starts the background thread that publishes the status.
+
+        @returns: None
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread and publishes the final status.
+
+        @returns: None
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.publish()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    #//////////////////////////////////////////////////////////////////////
+    # Internal Helper Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def _get_prometheus(self, status):
+        """
+        Formats the status as gauges in the Prometheus text format.
+
+        @rtype: C{str}
+        """
+        labels = 'job="%s",unit="%s"' % (self._escape(self.name), self._escape(self.meter.unit))
+        lines  = []
+        for key, suffix, text in self.metrics:
+            if status.get(key) is None:
+                continue
+            metric = "%s_%s" % (self.prefix, suffix)
+            lines.append("# HELP %s %s" % (metric, text))
+            lines.append("# TYPE %s gauge" % metric)
+            lines.append("%s{%s} %s" % (metric, labels, repr(float(status[key]))))
+        return '\n'.join(lines) + '\n'
+
+    def _escape(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def _run(self):
+        while True:
+            try:
+                self.publish()
+            except (IOError, OSError):
+                # Monitoring must never break the job itself
+                pass
+            if self.stopped.wait(self.interval):
+                break
+
 ###########################################################################
 ## Main Method for Testing
 ###########################################################################
@@ -0,0 +1,397 @@
+# simpleconsole.scheduler
+#
+# Copyright (C) 2012 Benjamin Bengfort
+# License: PSF
+# Author: Benjamin Bengfort <benjamin@bengfort.com>
+
+"""
+Runs periodic tasks from a daemon without a sleeping loop per task:
+
+    >>> scheduler = Scheduler(workers=4)
+    >>> scheduler.every(5, poll_queue, jitter=1)
+    >>> scheduler.cron('*/15 * * * *', rotate_reports, overrun='catchup')
+    >>> scheduler.run(stop_event)
+
+Due times are kept in a heap and the scheduler sleeps in select() until
+the earliest of them, so idle schedules cost nothing and thousands of
+tasks are dispatched with a heap pop each. Tasks run on a bounded pool of
+worker threads. Each occurrence is scheduled from the previous due time
+rather than from when the task finished, so schedules do not drift.
+
+A task that is still running when it is due again, or whose occurrences
+were missed because the workers were busy or the machine was suspended,
+either skips those occurrences (the default) or, with overrun="catchup",
+runs once for each of them (up to max_catchup) as soon as it can.
+"""
+
+__docformat__ = "epytext en"
+
+###########################################################################
+## Imports
+###########################################################################
+
+import os
+import sys
+import time
+import heapq
+import errno
+import fcntl
+import Queue
+import random
+import select
+import datetime
+import threading
+import traceback
+
+###########################################################################
+## Module Constants
+###########################################################################
+
+OVERRUN_POLICIES = ('skip', 'catchup')
+
+MAX_WAIT = 1.0          # Longest sleep, in case a wakeup is missed
+
+# Cron fields as (name, lowest value, highest value)
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour',   0, 23),
+    ('day',    1, 31),
+    ('month',  1, 12),
+    ('weekday', 0, 7),
+)
+
+CRON_ALIASES = {
+    '@yearly':   '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly':  '0 0 1 * *',
+    '@weekly':   '0 0 * * 0',
+    '@daily':    '0 0 * * *',
+    '@hourly':   '0 * * * *',
+}
+
+###########################################################################
+## Schedules
+###########################################################################
+
+class Interval(object):
+    """
+    Occurs every seconds seconds.
+    """
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("The interval must be positive")
+        self.seconds = float(seconds)
+
+    def first(self, now):
+        return now + self.seconds
+
+    def next(self, prev):
+        return prev + self.seconds
+
+    def __repr__(self):
+        return "<%s: %gs>" % (self.__class__.__name__, self.seconds)
+
+class Cron(object):
+    """
+    Occurs at the minutes matching a crontab expression in local time,
+    with the five fields minute, hour, day of month, month and day of week
+    (0 or 7 is Sunday). Fields are *, numbers, ranges (1-5), steps (*/15
+    or 0-30/10) or lists of these (1,15). As in cron, when both the day of
+    month and the day of week are given, a day matching either occurs.
+    The @hourly, @daily, @weekly, @monthly and @yearly aliases are allowed.
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        fields = CRON_ALIASES.get(expr.strip(), expr).split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError("Cron expression '%s' must have five fields" % expr)
+
+        values = [self.parse_field(field, low, high)
+                  for field, (name, low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = values
+
+        # Sunday is both 0 and 7
+        if 7 in self.weekdays:
+            self.weekdays = self.weekdays | frozenset([0])
+
+        self.any_day     = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            if '/' in part:
+                part, step = part.split('/', 1)
+                step = int(step)
+            else:
+                step = 1
+
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = [int(value) for value in part.split('-', 1)]
+            else:
+                start = end = int(part)
+                if step > 1:
+                    end = high
+
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError("Cron field '%s' is out of range %i-%i" % (field, low, high))
+            values.update(xrange(start, end + 1, step))
+        return frozenset(values)
+
+    def first(self, now):
+        return self.next(now)
+
+    def next(self, prev):
+        """
+        Returns the first minute after prev that matches the expression.
+        """
+        moment = datetime.datetime.fromtimestamp(prev).replace(second=0, microsecond=0)
+        moment += datetime.timedelta(minutes=1)
+
+        # Skip a month, day or hour at a time where possible
+        limit = moment.year + 5
+        while moment.year <= limit:
+            if moment.month not in self.months:
+                year, month = divmod(moment.month, 12)
+                moment = moment.replace(year=moment.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return time.mktime(moment.timetuple())
+
+        raise ValueError("Cron expression '%s' never occurs" % self.expr)
+
+    def matches_day(self, moment):
+        day     = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.expr)
+
+###########################################################################
+## Tasks
+###########################################################################
+
+class ScheduledTask(object):
+    """
+    A function to call on a schedule, along with its statistics.
+    """
+
+    def __init__(self, func, schedule, args=(), kwargs=None, name=None,
+                 jitter=0, overrun='skip', max_catchup=10):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError("Unknown overrun policy '%s'" % overrun)
+
+        self.func        = func
+        self.schedule    = schedule
+        self.args        = args
+        self.kwargs      = kwargs or {}
+        self.name        = name or getattr(func, '__name__', repr(func))
+        self.jitter      = jitter
+        self.overrun     = overrun
+        self.max_catchup = max_catchup
+
+        self.due       = None   # The next occurrence, without jitter
+        self.running   = False
+        self.pending   = 0      # Occurrences to catch up on
+        self.cancelled = False
+
+        self.runs     = 0
+        self.skipped  = 0
+        self.errors   = 0
+        self.max_late = 0.0     # Longest delay from due time to start
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return "<%s: %s %r>" % (self.__class__.__name__, self.name, self.schedule)
+
+###########################################################################
+## Scheduler
+###########################################################################
+
+class Scheduler(object):
+    """
+    Calls tasks on their schedules using a pool of workers threads. Tasks
+    may be added before or while the scheduler runs, from any thread.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+
+        self.heap    = []
+        self.lock    = threading.Lock()
+        self.queue   = Queue.Queue()
+        self.threads = []
+        self.count   = 0        # Tie breaker for tasks due at the same time
+        self.wakefd  = None
+
+    def every(self, seconds, func, *args, **kwargs):
+        """
+        Calls func every seconds seconds. Keyword arguments name, jitter,
+        overrun and max_catchup configure the task; others are passed on.
+        """
+        return self.add(func, Interval(seconds), *args, **kwargs)
+
+    def cron(self, expr, func, *args, **kwargs):
+        """
+        Calls func at the minutes matching the crontab expression.
+        """
+        return self.add(func, Cron(expr), *args, **kwargs)
+
+    def add(self, func, schedule, *args, **kwargs):
+        """
+        Schedules func and returns its L{ScheduledTask}, which can be
+        cancelled. Each occurrence is delayed by up to jitter seconds.
+        """
+        options = dict((key, kwargs.pop(key)) for key in
+                       ('name', 'jitter', 'overrun', 'max_catchup') if key in kwargs)
+        task = ScheduledTask(func, schedule, args, kwargs, **options)
+
+        with self.lock:
+            task.due = schedule.first(time.time())
+            self.push(task)
+        self.wake()
+        return task
+
+    def push(self, task):
+        due = task.due + (random.uniform(0, task.jitter) if task.jitter else 0)
+        self.count += 1
+        heapq.heappush(self.heap, (due, self.count, task))
+
+    def wake(self):
+        """
+        Wakes the scheduler to look at the heap again. Safe to call from a
+        signal handler.
+        """
+        if self.wakefd is not None:
+            try:
+                os.write(self.wakefd, 'x')
+            except OSError:
+                pass
+
+    def run(self, stop_event):
+        """
+        Runs the tasks until stop_event is set, then waits for the running
+        tasks to finish.
+        """
+        rfd, self.wakefd = os.pipe()
+        for fd in (rfd, self.wakefd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        for idx in xrange(self.workers):
+            thread = threading.Thread(target=self.work, name="scheduler-%i" % idx)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        try:
+            while not stop_event.is_set():
+                timeout = self.dispatch()
+                try:
+                    if select.select([rfd], [], [], timeout)[0]:
+                        while True:
+                            try:
+                                if not os.read(rfd, 4096):
+                                    break
+                            except OSError:
+                                break
+                except select.error as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+        finally:
+            wakefd, self.wakefd = self.wakefd, None
+            os.close(rfd)
+            os.close(wakefd)
+            for thread in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+
+    def dispatch(self):
+        """
+        Hands the tasks that are due to the workers and returns the number
+        of seconds until the next task is due.
+        """
+        now = time.time()
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due, _, task = heapq.heappop(self.heap)
+                if task.cancelled:
+                    continue
+
+                # Occurrences that have already passed were missed
+                missed, task.due = 0, task.schedule.next(task.due)
+                while task.due <= now:
+                    missed += 1
+                    task.due = task.schedule.next(task.due)
+
+                if task.overrun == 'catchup':
+                    task.pending = min(task.pending + missed, task.max_catchup)
+                else:
+                    task.skipped += missed
+
+                if not task.running:
+                    task.running = True
+                    task.max_late = max(task.max_late, now - due)
+                    self.queue.put(task)
+                elif task.overrun == 'catchup':
+                    task.pending = min(task.pending + 1, task.max_catchup)
+                else:
+                    task.skipped += 1
+
+                self.push(task)
+
+            if not self.heap:
+                return MAX_WAIT
+            return min(max(self.heap[0][0] - now, 0), MAX_WAIT)
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+
+            try:
+                task.func(*task.args, **task.kwargs)
+            except Exception:
+                task.errors += 1
+                sys.stderr.write("Scheduled task %s failed:\n" % task.name)
+                traceback.print_exc()
+
+            with self.lock:
+                task.runs += 1
+                if task.pending and not task.cancelled:
+                    task.pending -= 1
+                    self.queue.put(task)
+                else:
+                    task.running = False
+
+    def stats(self):
+        """
+        Returns the number of tasks and totals of their statistics.
+        """
+        with self.lock:
+            tasks = [task for _, _, task in self.heap]
+        return {
+            'tasks':    len(tasks),
+            'running':  sum(1 for task in tasks if task.running),
+            'runs':     sum(task.runs for task in tasks),
+            'skipped':  sum(task.skipped for task in tasks),
+            'errors':   sum(task.errors for task in tasks),
+            'max_late': max([task.max_late for task in tasks] or [0.0]),
+        }
@@ -0,0 +1,207 @@
+# simpleconsole.spool
+#
+# Copyright (C) 2012 Benjamin Bengfort
+# License: PSF
+# Author: Benjamin Bengfort <benjamin@bengfort.com>
+
+"""
+A durable queue of jobs kept in a local SQLite database, so that console
+commands can hand work to a running daemon rather than doing it inline:
+
+    >>> spool = JobSpool('/var/run/example.spool')
+    >>> spool.submit({'path': 'access.log'})
+    1
+    >>> job = spool.claim()
+    >>> try:
+    ...     process(job.payload)
+    ... except Exception as e:
+    ...     spool.retry(job, str(e))
+    ... else:
+    ...     spool.ack(job)
+
+Payloads are stored as JSON. A claimed job is leased to its consumer for
+lease seconds; if the consumer dies without acking or retrying it, the
+job is claimed again once the lease expires. Jobs that fail max_attempts
+times, or whose last lease expires, are kept in the failed state rather
+than retried, so a job that crashes its consumer is not retried forever.
+
+The database is in WAL mode, so a submit is a single small append, and
+it can be shared by any number of processes and threads.
+"""
+
+__docformat__ = "epytext en"
+
+###########################################################################
+## Imports
+###########################################################################
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from collections import namedtuple
+
+###########################################################################
+## Module Constants
+###########################################################################
+
+READY   = 'ready'       # Waiting to be claimed once it is available
+CLAIMED = 'claimed'     # Leased to a consumer until it is available again
+FAILED  = 'failed'      # Failed max_attempts times, kept for inspection
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id        INTEGER PRIMARY KEY AUTOINCREMENT,
+        payload   TEXT NOT NULL,
+        state     TEXT NOT NULL,
+        attempts  INTEGER NOT NULL DEFAULT 0,
+        available REAL NOT NULL,
+        created   REAL NOT NULL,
+        error     TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, available)",
+)
+
+# A claimed job; attempts identifies the claim when it is acked or retried
+Job = namedtuple('Job', 'id payload attempts')
+
+###########################################################################
+## Job Spool
+###########################################################################
+
+class JobSpool(object):
+    """
+    A durable job queue in the SQLite database at path, which is created
+    if it does not exist. Each thread (and forked process) gets its own
+    connection. Failed jobs are retried after retry_backoff seconds,
+    doubling with each attempt.
+    """
+
+    def __init__(self, path, lease=300.0, max_attempts=5, retry_backoff=10.0,
+                 synchronous='NORMAL'):
+        self.path          = path
+        self.lease         = lease
+        self.max_attempts  = max_attempts
+        self.retry_backoff = retry_backoff
+        self.synchronous   = synchronous
+
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        """
+        The connection for the current thread, opened on first use.
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.db  = self._connect()
+            local.pid = os.getpid()
+        return local.db
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._enable_wal(db)
+        db.execute("PRAGMA synchronous=%s" % self.synchronous)
+        for statement in SCHEMA:
+            db.execute(statement)
+        return db
+
+    def _enable_wal(self, db):
+        """
+        Switches the database to WAL mode, which is kept in the file, so
+        only the first connection to a new spool has to change it. When
+        several connect at once, all but one fail to change it as locked
+        and find it already changed.
+        """
+        if db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+            return
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            if db.execute("PRAGMA journal_mode").fetchone()[0] != 'wal':
+                raise
+
+    def submit(self, payload, delay=0):
+        """
+        Adds a job to the spool, available after delay seconds, and returns
+        its id.
+        """
+        now = time.time()
+        cursor = self.db.execute(
+            "INSERT INTO jobs (payload, state, available, created) VALUES (?, ?, ?, ?)",
+            (json.dumps(payload), READY, now + delay, now))
+        return cursor.lastrowid
+
+    def claim(self):
+        """
+        Claims the next available job, or a job whose lease has expired,
+        and returns it, or returns None if no job is available. Expired jobs
+        that have used all their attempts are marked failed instead.
+        """
+        now = time.time()
+        db  = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "UPDATE jobs SET state = ?, error = ? "
+                "WHERE state = ? AND available <= ? AND attempts >= ?",
+                (FAILED, "The lease expired", CLAIMED, now, self.max_attempts))
+
+            row = db.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE state IN (?, ?) "
+                "AND available <= ? ORDER BY available LIMIT 1",
+                (READY, CLAIMED, now)).fetchone()
+
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, available = ? WHERE id = ?",
+                    (CLAIMED, now + self.lease, row[0]))
+        except:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+        if row is None:
+            return None
+        return Job(row[0], json.loads(row[1]), row[2] + 1)
+
+    def ack(self, job):
+        """
+        Removes a completed job from the spool. Returns False if the claim
+        had expired and the job was claimed again in the meantime.
+        """
+        cursor = self.db.execute(
+            "DELETE FROM jobs WHERE id = ? AND state = ? AND attempts = ?",
+            (job.id, CLAIMED, job.attempts))
+        return cursor.rowcount > 0
+
+    def retry(self, job, error=None):
+        """
+        Returns a claimed job to the spool to be attempted again after the
+        retry backoff, or marks it failed if it has used all its attempts.
+        Returns False if the claim had expired.
+        """
+        if job.attempts >= self.max_attempts:
+            state, available = FAILED, time.time()
+        else:
+            state = READY
+            available = time.time() + self.retry_backoff * (2 ** (job.attempts - 1))
+
+        cursor = self.db.execute(
+            "UPDATE jobs SET state = ?, available = ?, error = ? "
+            "WHERE id = ? AND state = ? AND attempts = ?",
+            (state, available, error, job.id, CLAIMED, job.attempts))
+        return cursor.rowcount > 0
+
+    def counts(self):
+        """
+        Returns the number of jobs in each state.
+        """
+        counts = dict.fromkeys((READY, CLAIMED, FAILED), 0)
+        counts.update(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        return counts
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.path)
@@ -0,0 +1,998 @@
+# simpleconsole.streams
+#
+# Copyright (C) 2012 Benjamin Bengfort
+# License: PSF
+# Author: Benjamin Bengfort <benjamin@bengfort.com>
+
+"""
+Streaming helpers for reading and writing files from console commands.
+
+Compressed inputs are detected by their magic bytes rather than by their
+file extension, and are decompressed on a background thread so that the
+decompression overlaps with whatever the command does with the data:
+
+    >>> with open_compressed('access.log.gz') as f:
+    ...     for line in f:
+    ...         process(line)
+
+Outputs are written to a temporary file next to their destination, which
+is renamed over the destination only once it is completely written, and
+can be compressed on a background thread while the data is produced:
+
+    >>> with AtomicFile('export.txt.gz') as raw:
+    ...     with CompressingWriter(raw, 'gzip') as out:
+    ...         out.write(data)
+
+Long running processes can log through a L{LogWriter}, which collects
+writes in memory and writes them out in batches on a background thread,
+rotating the log file by size.
+
+The xz format requires the C{lzma} module, which is only available in the
+standard library from Python 3.3 (or from the C{backports.lzma} package).
+"""
+
+__docformat__ = "epytext en"
+
+###########################################################################
+## Imports
+###########################################################################
+
+import os
+import bz2
+import time
+import zlib
+import Queue
+import errno
+import tempfile
+import threading
+
+from collections import deque
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        # xz support is optional
+        lzma = None
+
+###########################################################################
+## Module Constants
+###########################################################################
+
+BLOCKSIZE = 64 * 1024       # Size of compressed blocks read from disk
+QUEUE_DEPTH = 16            # Decompressed blocks buffered ahead of reader
+WRITE_BUFFER = 1024 * 1024  # Size of the buffer for atomic writes
+LOG_BUFFER = 64 * 1024      # Bytes of log writes collected before a write
+LOG_PENDING = 8 * 1024 * 1024  # Bytes of log writes held before blocking
+
+# When to fsync atomic writes: never, the file before it is renamed, or
+# both the file and its directory so that the rename itself is durable.
+FSYNC_POLICIES = ('none', 'file', 'full')
+
+# Magic bytes at the start of each supported compressed format
+MAGIC = (
+    ('gzip', '\x1f\x8b'),
+    ('bz2',  'BZh'),
+    ('xz',   '\xfd7zXZ\x00'),
+)
+
+MAGIC_LENGTH = max(len(magic) for _, magic in MAGIC)
+
+DECOMPRESSORS = {
+    'gzip': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'bz2':  bz2.BZ2Decompressor,
+}
+
+# Compressors take the compression level, or None for the default level
+COMPRESSORS = {
+    'gzip': lambda level: zlib.compressobj(6 if level is None else level,
+                                           zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+    'bz2':  lambda level: bz2.BZ2Compressor(9 if level is None else level),
+}
+
+# File name suffixes of each compression format
+SUFFIXES = {
+    '.gz':  'gzip',
+    '.bz2': 'bz2',
+    '.xz':  'xz',
+}
+
+if lzma is not None:
+    DECOMPRESSORS['xz'] = lzma.LZMADecompressor
+    COMPRESSORS['xz']   = lambda level: lzma.LZMACompressor(preset=6 if level is None else level)
+
+###########################################################################
+## Compression Detection
+###########################################################################
+
+def sniff_compression(header):
+    """
+    Returns the name of the compression format whose magic bytes begin the
+    given header string, or None if the header is not recognized.
+
+    @param header: The first bytes of a file
+    @type header: C{str}
+
+    @rtype: C{str}
+    """
+    for kind, magic in MAGIC:
+        if header.startswith(magic):
+            return kind
+    return None
+
+def detect_compression(path):
+    """
+    Reads the first few bytes of the file at path and returns the name of
+    its compression format (gzip, bz2, or xz) or None if it is not
+    compressed in a recognized format.
+
+    @param path: The path to the file to check
+    @type path: C{str}
+
+    @rtype: C{str}
+    """
+    with open(path, 'rb') as f:
+        return sniff_compression(f.read(MAGIC_LENGTH))
+
+def compression_for_path(path):
+    """
+    Returns the name of the compression format implied by the suffix of
+    path (e.g. gzip for C{export.txt.gz}), or None if there isn't one.
+
+    @rtype: C{str}
+    """
+    return SUFFIXES.get(os.path.splitext(path)[1].lower())
+
+###########################################################################
+## Decompression
+###########################################################################
+
+def iter_decompressed(fobj, kind, blocksize=BLOCKSIZE):
+    """
+    Generator that reads compressed blocks from a file object and yields
+    the decompressed data. Concatenated streams (e.g. from C{cat a.gz b.gz})
+    are decompressed one after another, as gzip and bzip2 do.
+
+    @param fobj: A file object opened in binary mode
+    @param kind: The compression format, one of C{DECOMPRESSORS}
+    @param blocksize: The number of compressed bytes to read at a time
+
+    @raises: C{ValueError} if the compression format isn't supported
+    @raises: C{IOError} if the data ends before the end of the last stream,
+        e.g. because the file is truncated
+    """
+    if kind not in DECOMPRESSORS:
+        raise ValueError("Unsupported compression format '%s'" % kind)
+
+    factory = DECOMPRESSORS[kind]
+    engine  = factory()
+
+    while True:
+        data = fobj.read(blocksize)
+        if not data:
+            break
+
+        while data:
+            try:
+                chunk = engine.decompress(data)
+            except EOFError:
+                # The previous stream ended on a block boundary
+                engine = factory()
+                continue
+
+            if chunk:
+                yield chunk
+
+            # Leftover data is the start of the next concatenated stream,
+            # unless it is only the zero padding some tools append.
+            data = engine.unused_data
+            if data:
+                if not data.strip('\x00'):
+                    return
+                engine = factory()
+
+    if not stream_ended(engine):
+        raise IOError("Compressed data ended unexpectedly (%s)" % getattr(fobj, 'name', kind))
+
+def stream_ended(engine):
+    """
+    Returns True if the decompressor has reached the end of its stream.
+    Python 2 decompressors have no C{eof} attribute: a finished bz2
+    decompressor raises EOFError when given more data, and a finished zlib
+    decompressor leaves any more data unused, which is tried on a copy.
+    """
+    if hasattr(engine, 'eof'):
+        return engine.eof
+
+    if isinstance(engine, bz2.BZ2Decompressor):
+        try:
+            engine.decompress('')
+        except EOFError:
+            return True
+        return False
+
+    probe = engine.copy()
+    try:
+        probe.decompress('\x00')
+    except zlib.error:
+        return False
+    return probe.unused_data == '\x00'
+
+def decompress_to_queue(fobj, kind, blocksize, queue, stopped):
+    """
+    Puts the blocks decompressed from fobj on the queue, followed by None
+    to signal the end of the stream, or by the exception that stopped
+    decompression. Gives up once the stopped event is set.
+
+    This is the target of the thread of a L{DecompressingReader}, which
+    it does not refer to, so the reader can be collected (and closed) if
+    it is dropped while the thread is running.
+    """
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    try:
+        for chunk in iter_decompressed(fobj, kind, blocksize):
+            if not put(chunk):
+                return
+        put(None)
+    except Exception as e:
+        put(e)
+
+class DecompressingReader(object):
+    """
+    A read-only file-like object that decompresses a file on a background
+    thread, handing the decompressed blocks to the reader through a
+    bounded queue. Reading the data therefore overlaps with decompressing
+    it, and no more than C{depth} blocks are held in memory at a time.
+
+    The compressed data is read from path, or from the file object passed
+    as C{fobj} if the data has already been read into memory.
+
+    Supports C{read}, C{readline}, line iteration, and the context manager
+    protocol. Any exception raised while decompressing is re-raised in the
+    reading thread.
+    """
+
+    def __init__(self, path, kind, blocksize=BLOCKSIZE, depth=QUEUE_DEPTH, fobj=None):
+        self.name      = path
+        self.kind      = kind
+        self.blocksize = blocksize
+        self.closed    = False
+
+        self._fobj     = fobj if fobj is not None else open(path, 'rb')
+        self._queue    = Queue.Queue(maxsize=depth)
+        self._blocks   = deque()    # Blocks taken from the queue, not yet read
+        self._pos      = 0          # Offset of the unread data in the first block
+        self._size     = 0          # Number of unread bytes in the blocks
+        self._eof      = False
+        self._stopped  = threading.Event()
+
+        self._thread   = threading.Thread(target=decompress_to_queue, args=(
+            self._fobj, kind, blocksize, self._queue, self._stopped))
+        self._thread.daemon = True
+        self._thread.start()
+
+    #//////////////////////////////////////////////////////////////////////
+    # Internal Helper Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def _fill(self):
+        """
+        Moves the next decompressed block from the queue onto the blocks,
+        returning False once the stream is exhausted. Blocks are not joined
+        until they are read, so filling costs the same however much data
+        is buffered.
+
+        @rtype: C{bool}
+        """
+        if self._eof:
+            return False
+
+        item = self._queue.get()
+        if item is None:
+            self._eof = True
+            return False
+        if isinstance(item, Exception):
+            self._eof = True
+            raise item
+
+        if item:
+            self._blocks.append(item)
+            self._size += len(item)
+        return True
+
+    def _consume(self, size):
+        """
+        Removes and returns up to size bytes from the front of the blocks.
+        """
+        parts = []
+        while size > 0 and self._blocks:
+            block = self._blocks[0]
+            part  = block[self._pos:self._pos + size]
+            parts.append(part)
+            size -= len(part)
+            self._size -= len(part)
+            self._pos += len(part)
+            if self._pos >= len(block):
+                self._blocks.popleft()
+                self._pos = 0
+
+        if len(parts) == 1:
+            return parts[0]
+        return ''.join(parts)
+
+    #//////////////////////////////////////////////////////////////////////
+    # File Methods
+    #//////////////////////////////////////////////////////////////////////
+
+    def read(self, size=-1):
+        """
+        Reads at most size decompressed bytes, or until the end of the
+        stream if size is negative or omitted.
+
+        @rtype: C{str}
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            return self._consume(self._size)
+
+        while self._size < size and self._fill():
+            pass
+        return self._consume(size)
+
+    def readline(self, size=-1):
+        """
+        Reads one entire line from the decompressed stream, keeping the
+        trailing newline character.
+
+        @rtype: C{str}
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+        # Search each block once, filling more until a newline is found
+        end     = None
+        scanned = 0     # Number of blocks searched
+        offset  = 0     # Unread bytes in the blocks searched
+        while end is None:
+            while scanned < len(self._blocks):
+                block = self._blocks[scanned]
+                start = self._pos if scanned == 0 else 0
+                idx   = block.find('\n', start)
+                if idx >= 0:
+                    end = offset + idx + 1 - start
+                    break
+                offset  += len(block) - start
+                scanned += 1
+
+            if end is None and not self._fill():
+                end = self._size
+
+        if size is not None and 0 <= size < end:
+            end = size
+        return self._consume(end)
+
+    def readlines(self):
+        return list(self)
+
+    def close(self):
+        """
+        Stops the background thread and closes the underlying file.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._stopped.set()
+        self._thread.join()
+        self._fobj.close()
+        self._blocks.clear()
+        self._pos  = 0
+        self._size = 0
+
+    #//////////////////////////////////////////////////////////////////////
+    # Object Overrides
+    #//////////////////////////////////////////////////////////////////////
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __repr__(self):
+        return "<%s: %s (%s)>" % (self.__class__.__name__, self.name, self.kind)
+
+###########################################################################
+## Opening Files
+###########################################################################
+
+def open_compressed(path, blocksize=BLOCKSIZE, depth=QUEUE_DEPTH):
+    """
+    Opens the file at path for reading in binary mode. If the file is
+    compressed with gzip, bzip2, or xz (detected by its magic bytes) then a
+    L{DecompressingReader} is returned instead, otherwise a regular file.
+
+    @raises: C{IOError} if the file is compressed with a format that is not
+        supported by this Python installation.
+    """
+    kind = detect_compression(path)
+    if kind is None:
+        return open(path, 'rb')
+
+    if kind not in DECOMPRESSORS:
+        raise IOError("Cannot read %s: %s support is not installed" % (path, kind))
+
+    return DecompressingReader(path, kind, blocksize=blocksize, depth=depth)
+
+def iter_chunks(fobj, size=BLOCKSIZE):
+    """
+    Generator that reads a file-like object in chunks of the given size
+    until the end of the file is reached.
+    """
+    while True:
+        chunk = fobj.read(size)
+        if not chunk:
+            break
+        yield chunk
+
+###########################################################################
+## Line Writes
+###########################################################################
+
+class LineWriter(object):
+    """
+    Writes lines to a file object separated by newlines, but without a
+    trailing newline, collecting them into batches of batch_lines lines
+    so that there is neither a write per line nor the entire output held
+    in memory. Keeps count of the lines and bytes written.
+    """
+
+    def __init__(self, fobj, batch_lines=1024):
+        self.fobj        = fobj
+        self.batch_lines = batch_lines
+        self.lines       = 0
+        self.bytes       = 0
+
+        self._sep        = ''
+        self._batch      = []
+
+    def add(self, line):
+        self._batch.append(line)
+        self.lines += 1
+        self.bytes += len(line) + 1
+        if len(self._batch) >= self.batch_lines:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self.fobj.write(self._sep + '\n'.join(self._batch))
+            self._sep   = '\n'
+            self._batch = []
+
+###########################################################################
+## Atomic Writes
+###########################################################################
+
+class AtomicFile(object):
+    """
+    A writable file object that writes to a temporary file in the same
+    directory as path, and renames it to path when closed. Readers of path
+    therefore see either the old contents or the complete new contents,
+    never a partially written file. If the file is discarded, or the with
+    block raises an exception, the temporary file is removed and path is
+    left untouched.
+
+    The fsync policy is one of C{FSYNC_POLICIES}: "none" leaves flushing to
+    the operating system, "file" syncs the data before the rename, and
+    "full" also syncs the directory so the rename survives a crash.
+
+    If defer is True, closing the file only finishes the temporary file,
+    and it is renamed by commit(), so that several files can be written
+    and then all renamed into place, or all discarded.
+    """
+
+    def __init__(self, path, buffering=WRITE_BUFFER, fsync='file', defer=False):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy '%s'" % fsync)
+
+        self.name      = path
+        self.fsync     = fsync
+        self.defer     = defer
+        self.closed    = False
+        self.committed = False
+
+        dirname, basename = os.path.split(os.path.abspath(path))
+        fd, self.tmpname  = tempfile.mkstemp(dir=dirname, prefix='.%s.' % basename, suffix='.tmp')
+        self._fobj = os.fdopen(fd, 'wb', buffering)
+
+        # mkstemp creates the file readable only by its owner; give it the
+        # permissions the destination has or would have had with open().
+        try:
+            mode = os.stat(path).st_mode & 0777
+        except OSError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0666 & ~umask
+        os.chmod(self.tmpname, mode)
+
+    def write(self, data):
+        self._fobj.write(data)
+
+    def writelines(self, lines):
+        self._fobj.writelines(lines)
+
+    def flush(self):
+        self._fobj.flush()
+
+    def fileno(self):
+        return self._fobj.fileno()
+
+    def close(self):
+        """
+        Flushes and syncs the temporary file according to the fsync policy,
+        then renames it over the destination path unless the rename is
+        deferred to commit().
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            self._fobj.flush()
+            if self.fsync != 'none':
+                os.fsync(self._fobj.fileno())
+            self._fobj.close()
+        except:
+            self._remove()
+            raise
+
+        if not self.defer:
+            self.commit()
+
+    def commit(self):
+        """
+        Renames the closed temporary file over the destination path.
+        """
+        if self.committed:
+            return
+        if not self.closed:
+            raise ValueError("Cannot commit %s before it is closed" % self.name)
+        self.committed = True
+
+        try:
+            os.rename(self.tmpname, self.name)
+        except:
+            self._remove()
+            raise
+
+        if self.fsync == 'full':
+            fd = os.open(os.path.dirname(os.path.abspath(self.name)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def discard(self):
+        """
+        Closes and removes the temporary file, leaving the destination path
+        untouched. Does nothing once the file has been renamed.
+        """
+        if self.committed:
+            return
+        self.closed = True
+        self._fobj.close()
+        self._remove()
+
+    def _remove(self):
+        try:
+            os.remove(self.tmpname)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, tb):
+        if etype is None:
+            self.close()
+        else:
+            self.discard()
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.name)
+
+###########################################################################
+## Compression
+###########################################################################
+
+class CompressingWriter(object):
+    """
+    A write-only file-like object that compresses the data written to it
+    on a background thread, then writes the compressed data to the file
+    object fobj. Writes are collected into blocks of blocksize bytes and
+    handed to the thread through a bounded queue, so producing the output
+    overlaps with compressing it.
+
+    Closing the writer finishes the compressed stream but leaves fobj open
+    for its owner to close, unless C{closefd} is True. Any exception raised
+    while compressing or writing is re-raised in the writing thread.
+    """
+
+    def __init__(self, fobj, kind, level=None, blocksize=BLOCKSIZE, depth=QUEUE_DEPTH, closefd=False):
+        if kind not in COMPRESSORS:
+            raise ValueError("Unsupported compression format '%s'" % kind)
+
+        self.kind      = kind
+        self.level     = level
+        self.blocksize = blocksize
+        self.closefd   = closefd
+        self.closed    = False
+
+        self._fobj     = fobj
+        self._engine   = COMPRESSORS[kind](level)
+        self._queue    = Queue.Queue(maxsize=depth)
+        self._pending  = []
+        self._size     = 0
+        self._error    = None
+
+        self._thread   = threading.Thread(target=self._compress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _compress(self):
+        """
+        Runs on the background thread, compressing blocks from the queue
+        until None signals the end of the stream. After an error the queue
+        is still drained so that the writer never blocks.
+        """
+        while True:
+            block = self._queue.get()
+            if self._error is not None:
+                if block is None:
+                    return
+                continue
+
+            try:
+                if block is None:
+                    self._fobj.write(self._engine.flush())
+                    return
+
+                data = self._engine.compress(block)
+                if data:
+                    self._fobj.write(data)
+            except Exception as e:
+                self._error = e
+                if block is None:
+                    return
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def _send(self):
+        if self._pending:
+            self._queue.put(''.join(self._pending))
+            self._pending = []
+            self._size = 0
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        self._check()
+
+        self._pending.append(data)
+        self._size += len(data)
+        if self._size >= self.blocksize:
+            self._send()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """
+        Hands any collected writes to the compression thread. This does not
+        flush the compressor, which would hurt the compression ratio.
+        """
+        self._send()
+
+    def close(self):
+        """
+        Compresses the remaining data and writes the end of the compressed
+        stream, waiting for the background thread to finish.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._send()
+        self._queue.put(None)
+        self._thread.join()
+
+        if self._error is not None:
+            self._discard_fobj()
+            raise self._error
+        if self.closefd:
+            self._fobj.close()
+
+    def commit(self):
+        """
+        Commits fobj, if it is owned by the writer and defers its rename
+        (see L{AtomicFile}).
+        """
+        if self.closefd and hasattr(self._fobj, 'commit'):
+            self._fobj.commit()
+
+    def discard(self):
+        """
+        Stops the background thread without finishing the stream, used
+        when the output is abandoned because of an error. A closed writer
+        discards fobj if it owns it and it has not been committed.
+        """
+        if self.closed:
+            self._discard_fobj()
+            return
+        self.closed = True
+        self._pending = []
+        self._error = self._error or IOError("Compressed stream discarded")
+        self._queue.put(None)
+        self._thread.join()
+        self._discard_fobj()
+
+    def _discard_fobj(self):
+        if self.closefd:
+            if hasattr(self._fobj, 'discard'):
+                self._fobj.discard()
+            else:
+                self._fobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, tb):
+        if etype is None:
+            self.close()
+        else:
+            self.discard()
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.kind)
+
+###########################################################################
+## Log Files
+###########################################################################
+
+class LogWriter(object):
+    """
+    A write-only file-like object for logs that appends to path on a
+    background thread. Writes are only added to an in-memory queue, which
+    the thread writes out when it holds flush_bytes bytes or every
+    flush_interval seconds, so logging costs no system call per write. If
+    the queue grows beyond max_pending bytes, because the disk is slow,
+    the writer writes it out itself rather than use unbounded memory.
+
+    When the file grows beyond max_bytes it is renamed to path.1 (and older
+    logs to path.2 and so on, keeping backups of them) and a new file is
+    opened. The file is also reopened when reopen() is called, e.g. from a
+    signal handler after logrotate has moved it, or when the thread finds
+    that path no longer names the open file.
+
+    If fds are given, the file is duplicated onto those file descriptors
+    (e.g. 1 and 2), so that output written to them directly, such as by
+    child processes, goes to the current log file as well.
+
+    Note that flush() does not wait for the data to be written, since
+    logging calls it after every record; sync() does.
+    """
+
+    def __init__(self, path, fds=(), flush_bytes=LOG_BUFFER, flush_interval=1.0,
+                 max_bytes=None, backups=5, max_pending=LOG_PENDING):
+        self.name           = path
+        self.fds            = list(fds)
+        self.flush_bytes    = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_bytes      = max_bytes
+        self.backups        = backups
+        self.max_pending    = max_pending
+        self.closed         = False
+        self.softspace      = 0
+
+        self.fd = None
+        self._open()
+        self._start()
+
+    def _start(self):
+        self._pending      = deque()
+        self._pending_size = 0
+        self._reopen       = False
+        self._checked      = time.time()
+        self._lock         = threading.Lock()
+        self._size_lock    = threading.Lock()    # Guards _pending_size only
+        self._wake         = threading.Event()
+        self._thread       = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        if self.closed or type(data) is not str:
+            self._write_slow(data)
+            return
+
+        self._pending.append(data)
+        with self._size_lock:
+            self._pending_size += len(data)
+        if self._pending_size >= self.flush_bytes:
+            self._wake_writer()
+
+    def _write_slow(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if self.closed:
+            self._write(data)
+        else:
+            self.write(str(data))
+
+    def _wake_writer(self):
+        if self._pending_size >= self.max_pending:
+            self.sync()
+        elif not self._wake.is_set():
+            self._wake.set()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        """
+        Writes out everything written so far before returning.
+        """
+        with self._lock:
+            self._drain()
+
+    def reopen(self):
+        """
+        Asks the thread to reopen the file. Only sets a flag, so it is safe
+        to call from a signal handler.
+        """
+        self._reopen = True
+
+    def after_fork(self):
+        """
+        Restarts the background thread in a forked child, which shares the
+        file with its parent. Writes pending in the parent are left for the
+        parent, and only the parent rotates the file; the child reopens the
+        file once it notices that it has been rotated.
+        """
+        self.max_bytes = None
+        self._start()
+
+    def fileno(self):
+        return self.fd
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        """
+        Writes out any pending data and stops the background thread. Later
+        writes are written directly to the file.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._wake.set()
+        self._thread.join()
+        self.sync()
+
+    def _run(self):
+        while not self.closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.sync()
+            except EnvironmentError:
+                # There is nowhere left to report the error to
+                pass
+
+    def _drain(self):
+        """
+        Writes the pending data and reopens or rotates the file as needed.
+        Must be called with the lock held.
+        """
+        chunks = []
+        while self._pending:
+            chunks.append(self._pending.popleft())
+        if chunks:
+            data = ''.join(chunks)
+            with self._size_lock:
+                self._pending_size -= len(data)
+            self._write(data)
+
+        now = time.time()
+        if self._reopen or now - self._checked >= self.flush_interval:
+            self._checked = now
+            if self._reopen or self._moved():
+                self._reopen = False
+                self._open()
+
+        if self.max_bytes and not self.closed and os.fstat(self.fd).st_size >= self.max_bytes:
+            self._rotate()
+
+    def _write(self, data):
+        while data:
+            try:
+                written = os.write(self.fd, data)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            data = data[written:]
+
+    def _moved(self):
+        """
+        True if path no longer names the open file.
+        """
+        try:
+            stat = os.stat(self.name)
+        except OSError:
+            return True
+        opened = os.fstat(self.fd)
+        return (stat.st_dev, stat.st_ino) != (opened.st_dev, opened.st_ino)
+
+    def _rotate(self):
+        for idx in xrange(self.backups - 1, 0, -1):
+            src = "%s.%i" % (self.name, idx)
+            if os.path.exists(src):
+                os.rename(src, "%s.%i" % (self.name, idx + 1))
+
+        if self.backups > 0:
+            os.rename(self.name, self.name + '.1')
+        else:
+            os.remove(self.name)
+        self._open()
+
+    def _open(self):
+        fd = os.open(self.name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        if not self.fds:
+            if self.fd is not None:
+                os.close(self.fd)
+            self.fd = fd
+            return
+
+        for target in self.fds:
+            os.dup2(fd, target)
+        os.close(fd)
+        self.fd = self.fds[0]
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.name)